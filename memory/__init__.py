@@ -1,3 +1,11 @@
-from .factory import create_shared_memory_pair
-from .sender import SharedMemorySender
-from .receiver import SharedMemoryReceiver
\ No newline at end of file
+from .factory import (
+    create_shared_memory_pair,
+    create_broadcast_group,
+    create_multi_producer_pair,
+)
+from .sender import SharedMemorySender, SharedMemoryReservation
+from .broadcast import BroadcastSender
+from .receiver import SharedMemoryReceiver, SharedMemoryLease
+from .aio import AsyncSharedMemorySender, AsyncSharedMemoryReceiver
+from .reclaim import reclaim_orphaned_segments, SegmentSweeper
+from .memcopy import configure_parallel_copy
\ No newline at end of file
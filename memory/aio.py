@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import queue
+import time
+
+from .convert import serialize
+from .receiver import SharedMemoryReceiver
+from .sender import SharedMemorySender, _remaining
+
+# upper bound for a wait on released capacity, a full bounded channel is freed by
+# the receiver taking descriptors and doesn't signal the sender
+_RETRY_INTERVAL = 0.05
+# payloads of at least this size are copied into shared memory on a worker thread
+_OFFLOAD_BYTES = 1024 * 1024
+
+
+class AsyncSharedMemorySender:
+    # awaitable put, a sender out of capacity suspends the coroutine until the ack
+    # thread frees a segment instead of blocking the event loop
+
+    def __init__(self, sender: SharedMemorySender):
+        self.sender: SharedMemorySender = sender
+        self.loop: asyncio.AbstractEventLoop = None
+        self.released: asyncio.Event = None
+        self._callback = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self._callback is not None:
+            self.sender.release_callbacks.remove(self._callback)
+
+        released = asyncio.Event()
+
+        def callback():
+            try:
+                loop.call_soon_threadsafe(released.set)
+            except RuntimeError:
+                # event loop is closed already
+                pass
+
+        self.loop, self.released, self._callback = loop, released, callback
+        self.sender.release_callbacks.append(callback)
+
+    def _streams(self, payload) -> bool:
+        # later chunks wait for the receiver to free the stream window, which
+        # must not happen on the loop the receiver may be running on
+        chunk_size = self.sender.chunk_size
+        return bool(chunk_size) and payload.total_bytes > chunk_size
+
+    async def _put(self, data, batch: int, timeout: float):
+        self._bind()
+        # serialized once on the loop, retries only wait for capacity
+        payload = serialize(data)
+        put = functools.partial(self.sender._put, None, batch, False, None, payload)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.released.clear()
+            try:
+                if not self.sender._has_room():
+                    # checked first, a message which can't be sent isn't copied
+                    raise queue.Full
+                if payload.total_bytes < _OFFLOAD_BYTES and not self._streams(payload):
+                    return put()
+                return await self.loop.run_in_executor(None, put)
+            except queue.Full:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    raise
+            wait = (
+                _RETRY_INTERVAL
+                if remaining is None
+                else min(remaining, _RETRY_INTERVAL)
+            )
+            try:
+                await asyncio.wait_for(self.released.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def put(self, data, timeout: float = None):
+        await self._put(data, 0, timeout)
+
+    async def put_many(self, items: list, timeout: float = None):
+        if not items:
+            return
+        await self._put(list(items), len(items), timeout)
+
+    async def wait_for_all_ack(self):
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.sender.wait_for_all_ack
+        )
+
+
+class AsyncSharedMemoryReceiver:
+    # awaitable get, waits for the pipe of the data queue to become readable on the
+    # event loop, queues without a file descriptor fall back to a worker thread
+
+    def __init__(self, receiver: SharedMemoryReceiver):
+        self.receiver: SharedMemoryReceiver = receiver
+        self.loop: asyncio.AbstractEventLoop = None
+        # a file descriptor has one reader callback per loop, waiters take turns
+        self.lock: asyncio.Lock = None
+
+    def _fileno(self) -> int:
+        if self.receiver.prefetch:
+            # the prefetch thread reads the queue, it signals get instead
+            return None
+        reader = getattr(self.receiver.q_data_in, "_reader", None)
+        if reader is None:
+            return None
+        return reader.fileno()
+
+    async def get(self, timeout: float = None, zero_copy: bool = False):
+        try:
+            return self.receiver.get_nowait(zero_copy=zero_copy)
+        except queue.Empty:
+            pass
+
+        loop = asyncio.get_running_loop()
+        fileno = self._fileno()
+        if fileno is None:
+            get = functools.partial(self.receiver.get, True, timeout, zero_copy)
+            return await loop.run_in_executor(None, get)
+
+        if self.loop is not loop:
+            self.loop, self.lock = loop, asyncio.Lock()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self.lock.acquire(), _remaining(deadline))
+        except asyncio.TimeoutError:
+            raise queue.Empty
+        try:
+            return await self._wait_readable(loop, fileno, deadline, zero_copy)
+        finally:
+            self.lock.release()
+
+    async def _wait_readable(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        fileno: int,
+        deadline: float,
+        zero_copy: bool,
+    ):
+        while True:
+            try:
+                # may have arrived while waiting for the lock
+                return self.receiver.get_nowait(zero_copy=zero_copy)
+            except queue.Empty:
+                pass
+
+            # coalesced acks must not wait for the next message
+            self.receiver.flush_acks()
+            readable = loop.create_future()
+
+            def on_readable():
+                if not readable.done():
+                    readable.set_result(None)
+
+            loop.add_reader(fileno, on_readable)
+            try:
+                await asyncio.wait_for(readable, _remaining(deadline))
+            except asyncio.TimeoutError:
+                raise queue.Empty
+            finally:
+                loop.remove_reader(fileno)
+
+    async def get_many(
+        self, max_items: int, timeout: float = None, zero_copy: bool = False
+    ) -> list:
+        items = [await self.get(timeout, zero_copy)]
+        while len(items) < max_items:
+            try:
+                items.append(self.receiver.get_nowait(zero_copy=zero_copy))
+            except queue.Empty:
+                break
+        return items
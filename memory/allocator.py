@@ -0,0 +1,64 @@
+from typing import NamedTuple
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+import mmap
+
+from .pages import SegmentBacking
+from .reclaim import create_segment
+
+
+def close_segment(shm: SharedMemory):
+    # views of the segment may outlive its handle, a reserved region or the
+    # arrays of a zero-copy get. the mapping then stays until the last of them
+    # is released instead of being unmapped under them
+    try:
+        shm.close()
+    except BufferError:
+        shm._mmap = None
+        shm.close()
+
+
+def destroy_segment(shm: SharedMemory, unlinked: deque = None):
+    close_segment(shm)
+    shm.unlink()
+    if unlinked is not None:
+        unlinked.append(shm.name)
+
+
+class Block(NamedTuple):
+    shm: SharedMemory
+    offset: int
+    size: int
+    generation: int = 0
+
+    @property
+    def key(self) -> tuple[str, int]:
+        return self.shm.name, self.offset
+
+    @property
+    def buf(self) -> memoryview:
+        return self.shm.buf[self.offset : self.offset + self.size]
+
+
+class SegmentAllocator:
+    # one fresh segment per message, unlinked as soon as it is released
+
+    def __init__(self, backing: SegmentBacking = None):
+        self.backing: SegmentBacking = backing
+        # names of unlinked segments for receivers caching their mappings, only
+        # collected once the sender sets up the deque
+        self.unlinked: deque = None
+
+    def block_size(self, size: int) -> int:
+        # memory a message of size bytes takes, segments are backed by whole pages
+        return -(-max(size, 1) // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    def allocate(self, size: int, block: bool = True, timeout: float = None) -> Block:
+        shm = create_segment(size, self.backing)
+        return Block(shm, 0, size)
+
+    def release(self, block: Block):
+        destroy_segment(block.shm, self.unlinked)
+
+    def clear(self):
+        pass
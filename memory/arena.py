@@ -0,0 +1,99 @@
+from multiprocessing.shared_memory import SharedMemory
+import multiprocessing as mp
+from collections import deque
+import threading as th
+import bisect
+import time
+
+from .allocator import Block, destroy_segment
+from .pages import SegmentBacking
+from .reclaim import create_segment
+
+ALIGNMENT = 64
+
+
+def _align(size: int) -> int:
+    return (max(size, 1) + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedMemoryArena:
+    # one segment mapped up front, messages are carved out of it with a
+    # first-fit free list which coalesces neighbouring ranges on release
+
+    def __init__(self, size: int, backing: SegmentBacking = None):
+        self.size: int = _align(size)
+        self.shm: SharedMemory = create_segment(self.size, backing)
+
+        self.free_offsets: list[int] = [0]
+        self.free_sizes: list[int] = [self.size]
+        self.allocations: int = 0
+        self.has_space = th.Condition()
+        # names of unlinked segments, see SegmentAllocator
+        self.unlinked: deque = None
+
+    def block_size(self, size: int) -> int:
+        return _align(size)
+
+    def allocate(self, size: int, block: bool = True, timeout: float = None) -> Block:
+        size = _align(size)
+        if size > self.size:
+            raise ValueError(
+                f"Message of {size} bytes does not fit into arena of {self.size} bytes."
+            )
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.has_space:
+            while True:
+                offset = self._take(size)
+                if offset is not None:
+                    self.allocations += 1
+                    return Block(self.shm, offset, size, self.allocations)
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise mp.queues.Full
+                self.has_space.wait(remaining)
+
+    def _take(self, size: int) -> int:
+        for i, free_size in enumerate(self.free_sizes):
+            if free_size < size:
+                continue
+            offset = self.free_offsets[i]
+            if free_size == size:
+                del self.free_offsets[i]
+                del self.free_sizes[i]
+            else:
+                self.free_offsets[i] += size
+                self.free_sizes[i] -= size
+            return offset
+        return None
+
+    def release(self, block: Block):
+        offset, size = block.offset, block.size
+        with self.has_space:
+            i = bisect.bisect_left(self.free_offsets, offset)
+
+            # merge with the following free range
+            if i < len(self.free_offsets) and offset + size == self.free_offsets[i]:
+                size += self.free_sizes[i]
+                del self.free_offsets[i]
+                del self.free_sizes[i]
+
+            # merge with the preceding free range
+            if i > 0 and self.free_offsets[i - 1] + self.free_sizes[i - 1] == offset:
+                self.free_sizes[i - 1] += size
+            else:
+                self.free_offsets.insert(i, offset)
+                self.free_sizes.insert(i, size)
+
+            self.has_space.notify_all()
+
+    @property
+    def free_bytes(self) -> int:
+        return sum(self.free_sizes)
+
+    def clear(self):
+        if self.shm is None:
+            return
+        destroy_segment(self.shm, self.unlinked)
+        self.shm = None
@@ -0,0 +1,182 @@
+import multiprocessing as mp
+import threading as th
+
+from .convert import SMInfo
+from .sender import SharedMemorySender
+
+
+class BroadcastSender(SharedMemorySender):
+    # writes every message once and hands its descriptor to all subscribers,
+    # a segment is released once every subscriber it was delivered to has acked
+
+    def __init__(
+        self,
+        capacity: int,
+        q_data_outs: list[mp.Queue],
+        q_ack_in: mp.Queue,
+        policy: str = "block",
+        **options,
+    ):
+        assert policy in ("block", "drop"), "policy: block or drop"
+        # with drop, capacity limits the backlog of each subscriber instead of the
+        # number of messages in flight, so a slow subscriber can't stall the others
+        super().__init__(
+            capacity if policy == "block" else None, None, q_ack_in, **options
+        )
+        self.q_data_outs: list[mp.Queue] = q_data_outs
+        self.policy: str = policy
+        self.subscriber_capacity: int = capacity
+
+        self.backlog: list[int] = [0] * len(q_data_outs)
+        self.dropped: list[int] = [0] * len(q_data_outs)
+        self.refs: dict[tuple[str, int], set[int]] = {}
+        self.refs_lock = None
+        # subscribers whose processes died, skipped until one registers again
+        self.detached: set[int] = set()
+        # descriptors sent per subscriber, sequences are keyed by (key, subscriber)
+        self.sent: list[int] = [0] * len(q_data_outs)
+
+    def _initialize(self):
+        if self.is_initialized:
+            return
+        self.refs_lock = th.Lock()
+        super()._initialize()
+
+    def _is_full(self, backlog: int) -> bool:
+        if self.policy != "drop" or not self.subscriber_capacity:
+            return False
+        return backlog >= self.subscriber_capacity
+
+    def _release_ref(self, key: tuple[str, int], subscriber: int):
+        with self.refs_lock:
+            refs = self.refs.get(key)
+            if refs is None or subscriber not in refs:
+                return
+            refs.discard(subscriber)
+            self.sequences.pop((key, subscriber), None)
+            self.backlog[subscriber] -= 1
+            if refs:
+                return
+            del self.refs[key]
+        self._close_handle(key)
+
+    def _handle_ack(self, ack):
+        key, subscriber = ack
+        self._release_ref(key, subscriber)
+
+    def _check_receivers(self):
+        # one liveness registry per subscriber
+        for subscriber, receivers in enumerate(self.receivers):
+            is_dead = receivers.is_dead()
+            if subscriber in self.detached:
+                if not is_dead:
+                    self.detached.discard(subscriber)
+                continue
+            if not is_dead:
+                continue
+            # only messages the subscriber took, see SharedMemorySender
+            taken = receivers.taken_count()
+            with self.refs_lock:
+                self.detached.add(subscriber)
+                keys = [
+                    key
+                    for key, refs in self.refs.items()
+                    if subscriber in refs
+                    and self.sequences.get((key, subscriber), taken) < taken
+                ]
+            print(
+                f"BroadcastSender: subscriber {subscriber} died, "
+                f"releasing {len(keys)} messages"
+            )
+            if self.metrics:
+                self.metrics.add("reclaimed", len(keys))
+            for key in keys:
+                self._release_ref(key, subscriber)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["dropped"] = list(self.dropped)
+        stats["backlog"] = list(self.backlog)
+        stats["detached"] = sorted(self.detached)
+        return stats
+
+    def _send(self, info: SMInfo, block: bool, timeout: float):
+        if info.inline is not None:
+            subscribers = [
+                subscriber
+                for subscriber in range(len(self.q_data_outs))
+                if subscriber not in self.detached
+            ]
+            for i, subscriber in enumerate(subscribers):
+                try:
+                    self._deliver(info, subscriber, i, block, timeout)
+                except mp.queues.Full:
+                    if self.policy == "block":
+                        raise
+                    self.dropped[subscriber] += 1
+            return
+
+        with self.refs_lock:
+            subscribers = []
+            for subscriber, backlog in enumerate(self.backlog):
+                if subscriber in self.detached:
+                    continue
+                if self._is_full(backlog):
+                    self.dropped[subscriber] += 1
+                    continue
+                self.backlog[subscriber] += 1
+                subscribers.append(subscriber)
+            # set up before sending, acks may arrive before the loop below is done
+            self.refs[info.key] = set(subscribers)
+
+        if not subscribers:
+            with self.refs_lock:
+                del self.refs[info.key]
+            self._close_handle(info.key)
+            return
+
+        for i, subscriber in enumerate(subscribers):
+            try:
+                self._deliver(info, subscriber, i, block, timeout)
+            except mp.queues.Full:
+                if self.policy == "block":
+                    # nobody got the message yet, put gives the segment back
+                    with self.refs_lock:
+                        for other in subscribers:
+                            self.backlog[other] -= 1
+                        del self.refs[info.key]
+                    raise
+                # bounded channel of this subscriber is full, treat it as a drop
+                self.dropped[subscriber] += 1
+                self._release_ref(info.key, subscriber)
+
+    def _has_room(self) -> bool:
+        if self.policy == "drop":
+            return True
+        return not any(
+            q_data_out.full()
+            for subscriber, q_data_out in enumerate(self.q_data_outs)
+            if subscriber not in self.detached
+        )
+
+    def _deliver(
+        self, info: SMInfo, subscriber: int, index: int, block: bool, timeout: float
+    ):
+        if self.policy == "block" and index:
+            # others have the message already, it can't be taken back anymore and
+            # has to reach everyone, block and timeout only apply to the first
+            block, timeout = True, None
+        q_data_out = self.q_data_outs[subscriber]
+        if self.receivers is None:
+            q_data_out.put(info, block, timeout)
+            return
+        with self.send_lock:
+            key = info.key, subscriber
+            if info.smh_name is not None:
+                self.sequences[key] = self.sent[subscriber]
+            try:
+                q_data_out.put(info, block, timeout)
+            except BaseException:
+                self.sequences.pop(key, None)
+                raise
+            self.sent[subscriber] += 1
@@ -0,0 +1,41 @@
+import multiprocessing as mp
+import threading as th
+import time
+
+
+class ByteBudget:
+    # bytes of shared memory held by unacknowledged messages, a put waits until
+    # enough of them are released instead of filling up /dev/shm
+
+    def __init__(self, max_bytes: int, oversize: str = "raise", shared: bool = False):
+        assert oversize in ("raise", "alone"), "oversize: raise or alone"
+        self.max_bytes: int = max_bytes
+        # a message larger than the budget either raises or waits until it is the
+        # only one in flight
+        self.oversize: str = oversize
+        # shared between the producers of a channel or private to one sender
+        self.used = mp.Value("q", 0, lock=False)
+        self.changed = mp.Condition() if shared else th.Condition()
+
+    def acquire(self, nbytes: int, block: bool = True, deadline: float = None):
+        if nbytes > self.max_bytes and self.oversize == "raise":
+            raise ValueError(
+                f"Message of {nbytes} bytes exceeds budget of {self.max_bytes} bytes."
+            )
+
+        with self.changed:
+            while True:
+                used = self.used.value
+                if used + nbytes <= self.max_bytes or used == 0:
+                    self.used.value = used + nbytes
+                    return
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise mp.queues.Full
+                self.changed.wait(remaining)
+
+    def release(self, nbytes: int):
+        with self.changed:
+            self.used.value -= nbytes
+            self.changed.notify_all()
@@ -0,0 +1,58 @@
+from multiprocessing.shared_memory import SharedMemory
+from collections import OrderedDict
+
+from .allocator import close_segment
+
+
+class AttachCache:
+    # mappings of segments kept open across messages, so reused segments of a
+    # pool or an arena aren't mapped and faulted in again for every message.
+    # least recently used ones are closed once more than max_bytes are mapped,
+    # segments the sender unlinked are dropped as soon as it reports them
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.mapped_bytes: int = 0
+        # segment name -> mapping, least recently used first
+        self.segments: OrderedDict[str, SharedMemory] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def attach(self, name: str) -> SharedMemory:
+        # a reused segment keeps its name and mapping, only its generation changes
+        shm = self.segments.get(name)
+        if shm is not None:
+            self.segments.move_to_end(name)
+            self.hits += 1
+            return shm
+
+        self.misses += 1
+        shm = SharedMemory(name=name)
+        self.segments[name] = shm
+        self.mapped_bytes += shm.size
+        # the segment just attached stays, even if it exceeds the limit alone
+        while self.mapped_bytes > self.max_bytes and len(self.segments) > 1:
+            _, evicted = self.segments.popitem(last=False)
+            self._close(evicted)
+        return shm
+
+    def invalidate(self, names):
+        for name in names:
+            shm = self.segments.pop(name, None)
+            if shm is not None:
+                self._close(shm)
+
+    def _close(self, shm: SharedMemory):
+        self.mapped_bytes -= shm.size
+        close_segment(shm)
+
+    def clear(self):
+        self.invalidate(list(self.segments))
+
+    def stats(self) -> dict:
+        return {
+            "attach_hits": self.hits,
+            "attach_misses": self.misses,
+            "mapped_segments": len(self.segments),
+            "mapped_bytes": self.mapped_bytes,
+        }
@@ -0,0 +1,136 @@
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing import resource_tracker
+import multiprocessing as mp
+import pickle
+import atexit
+import struct
+import queue
+import os
+
+from .reclaim import create_segment
+
+_HEADER = struct.Struct("Q")
+# message length and, for messages spilled to a segment of their own, the
+# length of its name which the slot holds instead of the message
+_SLOT = struct.Struct("II")
+
+
+class SharedMemoryChannel:
+    # drop-in replacement for the mp.Queue carrying descriptors and acks: a ring
+    # of fixed size slots in shared memory, waiters sleep on semaphores (futex
+    # based on Linux) instead of going through a pipe and a feeder thread.
+    # messages larger than a slot are written to a segment the reader unlinks
+
+    def __init__(self, slots: int = 1024, slot_size: int = 512):
+        self.slots: int = slots
+        self.slot_size: int = slot_size
+
+        # head and tail counters followed by the slots
+        self.shm = create_segment(2 * _HEADER.size + slots * slot_size)
+        self.owner_pid: int = os.getpid()
+        atexit.register(self._unlink)
+
+        self.has_items = mp.Semaphore(0)
+        self.has_slots = mp.Semaphore(slots)
+        self.put_lock = mp.Lock()
+        self.get_lock = mp.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = SharedMemory(name=state["shm"])
+
+    def _unlink(self):
+        if os.getpid() != self.owner_pid or self.shm is None:
+            return
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        self._unlink()
+        self.shm = None
+
+    def full(self) -> bool:
+        # like mp.Queue.full, may be outdated as soon as it returns
+        buf = self.shm.buf
+        (head,) = _HEADER.unpack_from(buf, 0)
+        (tail,) = _HEADER.unpack_from(buf, _HEADER.size)
+        return head - tail >= self.slots
+
+    def put_nowait(self, obj):
+        return self.put(obj, block=False)
+
+    def put(self, obj, block: bool = True, timeout: float = None):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        length = len(data)
+        spilled = length > self.slot_size - _SLOT.size
+        if spilled and os.name == "nt":
+            # a segment is gone on Windows once the writer closes it
+            raise ValueError(
+                f"Message of {length} bytes exceeds channel slot size of "
+                f"{self.slot_size} bytes."
+            )
+        if not self.has_slots.acquire(block, timeout):
+            raise queue.Full
+
+        name = b""
+        if spilled:
+            try:
+                name = self._spill(data)
+            except BaseException:
+                self.has_slots.release()
+                raise
+            data = name
+
+        buf = self.shm.buf
+        with self.put_lock:
+            (head,) = _HEADER.unpack_from(buf, 0)
+            offset = 2 * _HEADER.size + (head % self.slots) * self.slot_size
+            _SLOT.pack_into(buf, offset, length, len(name))
+            buf[offset + _SLOT.size : offset + _SLOT.size + len(data)] = data
+            _HEADER.pack_into(buf, 0, head + 1)
+        self.has_items.release()
+
+    def _spill(self, data: bytes) -> bytes:
+        shm = create_segment(len(data))
+        shm.buf[: len(data)] = data
+        shm.close()
+        # unlinked by the reader, not by this process at exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm.name.encode()
+
+    def _read_spilled(self, name: str, length: int) -> bytes:
+        shm = SharedMemory(name=name)
+        data = bytes(shm.buf[:length])
+        shm.close()
+        shm.unlink()
+        return data
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get(self, block: bool = True, timeout: float = None):
+        if not self.has_items.acquire(block, timeout):
+            raise queue.Empty
+
+        buf = self.shm.buf
+        with self.get_lock:
+            (tail,) = _HEADER.unpack_from(buf, _HEADER.size)
+            offset = 2 * _HEADER.size + (tail % self.slots) * self.slot_size
+            length, spilled = _SLOT.unpack_from(buf, offset)
+            start = offset + _SLOT.size
+            data = bytes(buf[start : start + (spilled or length)])
+            _HEADER.pack_into(buf, _HEADER.size, tail + 1)
+        self.has_slots.release()
+        if spilled:
+            data = self._read_spilled(data.decode(), length)
+        return pickle.loads(data)
@@ -0,0 +1,174 @@
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# binary layout for ndarrays and flat dicts / tuples of them, much cheaper to
+# encode and decode than the pickle machinery for small and medium arrays:
+#   header: container kind, item count, then per item an optional dict key and
+#   a tagged value, arrays are described by dtype and shape while their data
+#   follows the header as separate buffers in the same order
+_CONTAINER = struct.Struct("<BH")
+_LENGTH = struct.Struct("<H")
+_STR_LENGTH = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+_SINGLE, _TUPLE, _DICT = 0, 1, 2
+_MAX_ITEMS = 64
+_MAX_NDIM = 32
+# dict keys are prefixed by their _LENGTH
+_MAX_KEY_BYTES = 0xFFFF
+# plain numeric dtypes only, they round trip through their dtype string
+_DTYPE_KINDS = "biufcmM"
+
+_INT_MIN, _INT_MAX = -(1 << 63), (1 << 63) - 1
+_shapes: dict[int, struct.Struct] = {}
+_dtypes: dict[bytes, "np.dtype"] = {}
+
+
+def _shape_struct(ndim: int) -> struct.Struct:
+    shape = _shapes.get(ndim)
+    if shape is None:
+        shape = _shapes[ndim] = struct.Struct(f"<{ndim}q")
+    return shape
+
+
+def _encode_value(value, header: list, buffers: list) -> bool:
+    kind = type(value)
+    if kind is np.ndarray:
+        dtype = value.dtype
+        if (
+            dtype.kind not in _DTYPE_KINDS
+            or dtype.fields is not None
+            or value.ndim > _MAX_NDIM
+            or not value.flags.c_contiguous
+        ):
+            return False
+        dtype_str = dtype.str.encode()
+        header.append(b"a")
+        header.append(bytes((len(dtype_str), value.ndim)))
+        header.append(dtype_str)
+        header.append(_shape_struct(value.ndim).pack(*value.shape))
+        buffers.append(value.reshape(-1).view(np.uint8).data)
+    elif kind is int:
+        if not _INT_MIN <= value <= _INT_MAX:
+            return False
+        header.append(b"i")
+        header.append(_INT.pack(value))
+    elif kind is float:
+        header.append(b"f")
+        header.append(_FLOAT.pack(value))
+    elif kind is bool:
+        header.append(b"t" if value else b"F")
+    elif value is None:
+        header.append(b"n")
+    elif kind is str:
+        encoded = value.encode()
+        header.append(b"s")
+        header.append(_STR_LENGTH.pack(len(encoded)))
+        header.append(encoded)
+    else:
+        return False
+    return True
+
+
+def encode(data) -> tuple[bytes, list[memoryview]]:
+    # None if data isn't made of arrays and scalars only, pickle handles it then
+    if np is None:
+        return None
+
+    kind = type(data)
+    if kind is np.ndarray:
+        container, values = _SINGLE, (data,)
+    elif kind is tuple:
+        container, values = _TUPLE, data
+    elif kind is dict:
+        container, values = _DICT, data.values()
+    else:
+        return None
+    if len(values) > _MAX_ITEMS:
+        return None
+
+    header = [_CONTAINER.pack(container, len(values))]
+    buffers = []
+    if container == _DICT:
+        for key, value in data.items():
+            if type(key) is not str:
+                return None
+            encoded = key.encode()
+            if len(encoded) > _MAX_KEY_BYTES:
+                return None
+            header.append(_LENGTH.pack(len(encoded)))
+            header.append(encoded)
+            if not _encode_value(value, header, buffers):
+                return None
+    else:
+        for value in values:
+            if not _encode_value(value, header, buffers):
+                return None
+
+    if not buffers:
+        # scalars only, nothing to gain over pickle
+        return None
+    return b"".join(header), buffers
+
+
+def _decode_value(header, offset: int, buffers: list) -> tuple[any, int]:
+    tag = header[offset]
+    offset += 1
+    if tag == 0x61:  # a
+        dtype_length, ndim = header[offset], header[offset + 1]
+        offset += 2
+        dtype_str = bytes(header[offset : offset + dtype_length])
+        dtype = _dtypes.get(dtype_str)
+        if dtype is None:
+            dtype = _dtypes[dtype_str] = np.dtype(dtype_str.decode())
+        offset += dtype_length
+        shape_struct = _shape_struct(ndim)
+        shape = shape_struct.unpack_from(header, offset)
+        offset += shape_struct.size
+        # frombuffer holds an export of the buffer, which keeps a segment mapped
+        # for as long as the array is alive
+        return np.frombuffer(buffers.pop(), dtype).reshape(shape), offset
+    if tag == 0x69:  # i
+        return _INT.unpack_from(header, offset)[0], offset + _INT.size
+    if tag == 0x66:  # f
+        return _FLOAT.unpack_from(header, offset)[0], offset + _FLOAT.size
+    if tag == 0x74:  # t
+        return True, offset
+    if tag == 0x46:  # F
+        return False, offset
+    if tag == 0x6E:  # n
+        return None, offset
+    if tag == 0x73:  # s
+        (length,) = _STR_LENGTH.unpack_from(header, offset)
+        offset += _STR_LENGTH.size
+        return str(header[offset : offset + length], "utf-8"), offset + length
+    raise ValueError(f"Unknown value tag {tag} in array header.")
+
+
+def decode(header, buffers: list) -> any:
+    # buffers are taken from the end, reverse them once to keep their order
+    buffers = buffers[::-1]
+    container, count = _CONTAINER.unpack_from(header, 0)
+    offset = _CONTAINER.size
+
+    if container == _DICT:
+        result = {}
+        for _ in range(count):
+            (length,) = _LENGTH.unpack_from(header, offset)
+            offset += _LENGTH.size
+            key = str(header[offset : offset + length], "utf-8")
+            result[key], offset = _decode_value(header, offset + length, buffers)
+        return result
+
+    values = []
+    for _ in range(count):
+        value, offset = _decode_value(header, offset, buffers)
+        values.append(value)
+    if container == _SINGLE:
+        return values[0]
+    return tuple(values)
@@ -2,52 +2,408 @@ from typing import NamedTuple
 from multiprocessing.shared_memory import SharedMemory
 import pickle
 from pickle import PickleBuffer
+from array import array
+import time
+
+from .allocator import Block, SegmentAllocator
+from .cache import AttachCache
+from .memcopy import copy_into, copy_out, new_buffer
+from . import codec
+from .metrics import Metrics
+
+# plain buffers of at least this size are sent out-of-band like ndarrays
+OUT_OF_BAND_MIN_BYTES = 64 * 1024
+# upper bound of container items looked at per message when searching for them
+_MAX_SCAN_ITEMS = 1024
+# out-of-band buffers and reserved regions start at this alignment within
+# their message, arrays backed by the segment are then aligned for SIMD loads
+_BUFFER_ALIGNMENT = 64
+
+# how the buffers of a message are turned back into data
+CODEC_PICKLE = 0
+CODEC_ARRAYS = 1
+# raw bytes sent by put_stream, no serialization involved
+CODEC_RAW = 2
 
 
 class SMInfo(NamedTuple):
     smh_name: str
     total_bytes: int
     buffer_lengths: list[int]
+    generation: int = 0
+    offset: int = 0
+    # small messages travel inside the descriptor, smh_name is None then
+    inline: bytes = None
+    # number of items packed into the message by put_many, 0 for a single item
+    batch: int = 0
+    # index of the sending producer when a channel has several
+    producer: int = None
+    codec: int = CODEC_PICKLE
+    # only set while tracing, follows the message across processes
+    message_id: str = None
+    # (index, is last) of a streamed chunk, total_bytes is the chunk size then and
+    # buffer_lengths those of the whole message, sent with the first chunk only
+    chunk: tuple[int, bool] = None
+    # segments the sender unlinked since its previous descriptor, receivers
+    # caching mappings close them
+    unlinked: tuple[str] = None
 
+    @property
+    def key(self) -> tuple[str, int]:
+        return self.smh_name, self.offset
 
-def data_to_smh(data: any) -> tuple[SharedMemory, SMInfo]:
-    buffers: list[PickleBuffer] = []
-    buffer_lengths: list[int] = []
 
-    def _append_buffer(buffer: PickleBuffer):
-        memview = buffer.raw()
-        buffers.append(memview)
-        buffer_lengths.append(len(memview))
+def _memoryview_from_buffer(buffer, format: str, shape: tuple) -> memoryview:
+    return memoryview(buffer).cast("B").cast(format, shape)
+
+
+def _array_from_buffer(buffer, typecode: str) -> array:
+    result = array(typecode)
+    result.frombytes(buffer)
+    return result
+
+
+def _ndarray_from_buffer(buffer, dtype, shape: tuple):
+    import numpy as np
+
+    return np.frombuffer(buffer, dtype).reshape(shape)
+
+
+class _OutOfBand:
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __reduce_ex__(self, protocol):
+        obj = self.obj
+        kind = type(obj)
+        if kind is memoryview:
+            return _memoryview_from_buffer, (PickleBuffer(obj), obj.format, obj.shape)
+        if kind is array:
+            return _array_from_buffer, (PickleBuffer(obj), obj.typecode)
+        return kind, (PickleBuffer(obj),)
+
+
+class _Cycle(Exception):
+    pass
+
+
+# marks containers whose items are being scanned
+_SCANNING = object()
+
+
+def _route_out_of_band(data: any) -> any:
+    # pickle only hands PickleBuffer aware objects to the buffer callback and
+    # never asks a reducer about exact bytes, so large plain buffers found in
+    # (nested) dicts, lists and tuples are wrapped before pickling instead
+    budget = _MAX_SCAN_ITEMS
+    # id -> replacement, the same object is wrapped or rebuilt only once so
+    # pickle keeps sending it once and the receiver gets one object again
+    seen: dict[int, any] = {}
 
-    main = pickle.dumps(data, pickle.HIGHEST_PROTOCOL, buffer_callback=_append_buffer)
+    def _scan(obj):
+        nonlocal budget
+        kind = type(obj)
+        if kind is bytes or kind is bytearray:
+            wrap = len(obj) >= OUT_OF_BAND_MIN_BYTES
+        elif kind is array:
+            wrap = len(obj) * obj.itemsize >= OUT_OF_BAND_MIN_BYTES
+        elif kind is memoryview:
+            # memoryviews can't be pickled otherwise
+            wrap = obj.c_contiguous
+        elif kind is dict or kind is list or kind is tuple:
+            wrap = None
+        else:
+            return obj
 
-    len_main = len(main)
-    total_bytes = len_main + sum(buffer_lengths)
-    buffer_lengths.insert(0, len_main)
-    buffers.insert(0, main)
+        key = id(obj)
+        result = seen.get(key)
+        if result is _SCANNING:
+            # a rebuilt container can't reference itself, see below
+            raise _Cycle
+        if result is not None:
+            return result
+        if wrap is not None:
+            result = _OutOfBand(obj) if wrap else obj
+            seen[key] = result
+            return result
 
-    shm: SharedMemory = SharedMemory(create=True, size=total_bytes)
+        seen[key] = obj
+        if len(obj) > budget:
+            return obj
+        seen[key] = _SCANNING
+        budget -= len(obj)
+
+        if kind is dict:
+            items = {k: _scan(v) for k, v in obj.items()}
+            changed = any(items[k] is not v for k, v in obj.items())
+        else:
+            items = [_scan(v) for v in obj]
+            changed = any(a is not b for a, b in zip(items, obj))
+            if kind is tuple:
+                items = tuple(items)
+
+        result = items if changed else obj
+        seen[key] = result
+        return result
+
+    try:
+        return _scan(data)
+    except _Cycle:
+        # self-referencing data is pickled as it is, buffers stay in-band
+        return data
+
+
+class _GatherWriter:
+    # collects the pickle stream without joining it, large payloads are passed
+    # to write() by reference and only get copied once, into the segment
+    def __init__(self):
+        self.chunks: list = []
+        self.nbytes: int = 0
+
+    def write(self, chunk) -> int:
+        length = chunk.nbytes if isinstance(chunk, memoryview) else len(chunk)
+        self.chunks.append(chunk)
+        self.nbytes += length
+        return length
+
+
+class Payload(NamedTuple):
+    chunks: list
+    total_bytes: int
+    buffer_lengths: list[int]
+    codec: int = CODEC_PICKLE
+
+
+def _buffer_offsets(buffer_lengths: list[int]):
+    # (offset, length) of every buffer of a message, the main one comes first
+    # and each out-of-band one starts at the next aligned offset after it
     offset = 0
-    for length, buffer in zip(buffer_lengths, buffers):
-        shm.buf[offset : offset + length] = buffer
+    for index, length in enumerate(buffer_lengths):
+        if index:
+            offset += -offset % _BUFFER_ALIGNMENT
+        yield offset, length
         offset += length
 
-    info: SMInfo = SMInfo(shm.name, total_bytes, buffer_lengths)
-    return shm, info
 
+def _layout(main: list, len_main: int, buffers: list, codec_id: int) -> Payload:
+    # the main chunks followed by the buffers, zero padded to their offsets
+    chunks = list(main)
+    buffer_lengths = [len_main]
+    offset = len_main
+    for buffer in buffers:
+        padding = -offset % _BUFFER_ALIGNMENT
+        if padding:
+            chunks.append(bytes(padding))
+        chunks.append(buffer)
+        buffer_lengths.append(buffer.nbytes)
+        offset += padding + buffer.nbytes
+    return Payload(chunks, offset, buffer_lengths, codec_id)
 
-def data_from_smh(info: SMInfo) -> any:
-    shm: SharedMemory = SharedMemory(name=info.smh_name, size=info.total_bytes)
-    local_buffers: bytes = bytes(shm.buf[: info.total_bytes])
-    shm.close()
 
-    # unpack data
-    buffers = []
-    offset = 0
-    for length in info.buffer_lengths:
-        buffer = local_buffers[offset : offset + length]
-        buffers.append(buffer)
+def serialize(data: any) -> Payload:
+    encoded = codec.encode(data)
+    if encoded is not None:
+        header, buffers = encoded
+        return _layout([header], len(header), buffers, CODEC_ARRAYS)
+
+    buffers: list[memoryview] = []
+
+    def _append_buffer(buffer: PickleBuffer):
+        buffers.append(buffer.raw())
+
+    main = _GatherWriter()
+    pickle.Pickler(main, pickle.HIGHEST_PROTOCOL, buffer_callback=_append_buffer).dump(
+        _route_out_of_band(data)
+    )
+    return _layout(main.chunks, main.nbytes, buffers, CODEC_PICKLE)
+
+
+class _Reserved:
+    # pickled in place of a reserved region, which is written later on
+    __slots__ = ("reconstructor", "args")
+
+    def __init__(self, reconstructor: callable, args: tuple):
+        self.reconstructor = reconstructor
+        self.args = args
+
+    def __reduce_ex__(self, protocol):
+        return self.reconstructor, (PickleBuffer(bytearray()), *self.args)
+
+
+def reserve_payload(nbytes: int, reconstructor: callable, args: tuple) -> Payload:
+    # the main pickle and its padding, followed by room for a single out-of-band
+    # buffer, the empty placeholder is left out
+    payload = serialize(_Reserved(reconstructor, args))
+    len_main = payload.buffer_lengths[0]
+    return Payload(
+        payload.chunks[:-1], payload.total_bytes + nbytes, [len_main, nbytes]
+    )
+
+
+def payload_to_smh(payload: Payload, block: Block, batch: int = 0) -> SMInfo:
+    buf = block.shm.buf
+    offset = block.offset
+    for chunk in payload.chunks:
+        if isinstance(chunk, memoryview) and chunk.format != "B":
+            chunk = chunk.cast("B")
+        length = len(chunk)
+        copy_into(buf[offset : offset + length], chunk)
         offset += length
 
+    return SMInfo(
+        block.shm.name,
+        payload.total_bytes,
+        payload.buffer_lengths,
+        block.generation,
+        block.offset,
+        batch=batch,
+        codec=payload.codec,
+    )
+
+
+def split_chunks(buffers, chunk_size: int):
+    # regroups buffers into chunks of chunk_size bytes, as lists of views into
+    # them, the last chunk may be shorter and an empty stream has one empty chunk
+    pieces, nbytes, count = [], 0, 0
+    for buffer in buffers:
+        view = memoryview(buffer).cast("B")
+        while len(view):
+            take = min(chunk_size - nbytes, len(view))
+            pieces.append(view[:take])
+            nbytes += take
+            view = view[take:]
+            if nbytes == chunk_size:
+                yield pieces, nbytes
+                pieces, nbytes, count = [], 0, count + 1
+    if nbytes or not count:
+        yield pieces, nbytes
+
+
+def _attach(info: SMInfo, cache: AttachCache) -> SharedMemory:
+    if cache is not None:
+        return cache.attach(info.smh_name)
+    return SharedMemory(name=info.smh_name, size=info.total_bytes)
+
+
+def stream_buffers(buffer_lengths: list[int]) -> tuple[list, list]:
+    # buffers a streamed message is reassembled into, and (offset, writable view)
+    # of each within the message. out-of-band ones are bytes where new_buffer
+    # allows, unpickling takes those as they are instead of copying them again
+    buffers, regions = [], []
+    for index, (offset, length) in enumerate(_buffer_offsets(buffer_lengths)):
+        if index:
+            buffer, view = new_buffer(length)
+        else:
+            buffer = bytearray(length)
+            view = memoryview(buffer)
+        buffers.append(buffer)
+        regions.append((offset, view))
+    return buffers, regions
+
+
+def chunk_from_smh(info: SMInfo, out, offset: int = None, cache: AttachCache = None):
+    # copies a streamed chunk at offset of its message into the regions of
+    # stream_buffers it overlaps, appends it to a bytearray without an offset
+    if info.smh_name is None:
+        return
+    shm = _attach(info, cache)
+    buf = shm.buf[info.offset : info.offset + info.total_bytes]
+    if offset is None:
+        out += buf
+    else:
+        end = offset + info.total_bytes
+        for start, view in out:
+            low, high = max(start, offset), min(start + len(view), end)
+            if low < high:
+                copy_into(
+                    view[low - start : high - start], buf[low - offset : high - offset]
+                )
+    buf.release()
+    if cache is None:
+        shm.close()
+
+
+def payload_to_inline(payload: Payload, batch: int = 0) -> SMInfo:
+    inline = b"".join(payload.chunks)
+    return SMInfo(
+        None,
+        payload.total_bytes,
+        payload.buffer_lengths,
+        inline=inline,
+        batch=batch,
+        codec=payload.codec,
+    )
+
+
+def data_to_smh(data: any, allocate: callable = None) -> tuple[Block, SMInfo]:
+    payload = serialize(data)
+    allocate = allocate or SegmentAllocator().allocate
+    block: Block = allocate(payload.total_bytes)
+    return block, payload_to_smh(payload, block)
+
+
+def _split(buf, info: SMInfo) -> list:
+    return [
+        buf[offset : offset + length]
+        for offset, length in _buffer_offsets(info.buffer_lengths)
+    ]
+
+
+def _unpack(buffers: list, codec_id: int = CODEC_PICKLE) -> any:
     main = buffers.pop(0)
+    if codec_id == CODEC_ARRAYS:
+        return codec.decode(main, buffers)
     return pickle.loads(main, buffers=buffers)
+
+
+def data_from_inline(info: SMInfo, metrics: Metrics = None) -> any:
+    if metrics:
+        start = time.perf_counter_ns()
+    data = _unpack(_split(memoryview(info.inline), info), info.codec)
+    if metrics:
+        metrics.record("deserialize", start, info.message_id)
+    return data
+
+
+def data_from_smh(
+    info: SMInfo, metrics: Metrics = None, cache: AttachCache = None
+) -> any:
+    if metrics:
+        start = time.perf_counter_ns()
+    shm = _attach(info, cache)
+    if metrics:
+        start = metrics.record("attach", start, info.message_id)
+    buf = shm.buf[info.offset : info.offset + info.total_bytes]
+    # copy every buffer on its own, exact bytes are then reused as they are
+    local_buffers: list = [copy_out(buffer) for buffer in _split(buf, info)]
+    buf.release()
+    if cache is None:
+        shm.close()
+    if metrics:
+        start = metrics.record("copy", start, info.message_id)
+
+    # unpack data
+    data = _unpack(local_buffers, info.codec)
+    if metrics:
+        metrics.record("deserialize", start, info.message_id)
+    return data
+
+
+def data_from_smh_zero_copy(
+    info: SMInfo, metrics: Metrics = None
+) -> tuple[any, SharedMemory]:
+    # buffers stay backed by the segment, it must stay mapped as long as data is used
+    if metrics:
+        start = time.perf_counter_ns()
+    shm: SharedMemory = SharedMemory(name=info.smh_name, size=info.total_bytes)
+    if metrics:
+        start = metrics.record("attach", start, info.message_id)
+    buf = shm.buf[info.offset : info.offset + info.total_bytes]
+    data = _unpack(_split(buf, info), info.codec)
+    # the views of the buffers hold the mapping on their own
+    buf.release()
+    if metrics:
+        metrics.record("deserialize", start, info.message_id)
+    return data, shm
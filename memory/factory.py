@@ -1,13 +1,233 @@
+from typing import NamedTuple
 import multiprocessing as mp
+import time
 
+from .allocator import SegmentAllocator
+from .budget import ByteBudget
+from .broadcast import BroadcastSender
+from .channel import SharedMemoryChannel
+from .convert import (
+    data_from_inline,
+    data_from_smh,
+    payload_to_inline,
+    payload_to_smh,
+    serialize,
+)
 from .receiver import SharedMemoryReceiver
+from .reclaim import LivenessRegistry
 from .sender import SharedMemorySender
 
 
-def create_shared_memory_pair(capacity):
-    data_queue = mp.Queue()
-    ack_queue = mp.Queue()
+def calibrate_inline_threshold(max_bytes: int = 4_000_000, repeats: int = 5) -> int:
+    # smallest payload size for which a shared memory segment beats sending the
+    # payload along with the descriptor, measured in the calling process
+    queue = mp.Queue()
+    allocator = SegmentAllocator()
 
-    sender = SharedMemorySender(capacity, data_queue, ack_queue)
-    receiver = SharedMemoryReceiver(data_queue, ack_queue)
+    def _measure(send: callable, receive: callable) -> float:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            queue.put(send())
+            receive(queue.get())
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _send_smh():
+        block = allocator.allocate(payload.total_bytes)
+        blocks.append(block)
+        return payload_to_smh(payload, block)
+
+    size = 1_000
+    try:
+        while size < max_bytes:
+            payload = serialize(bytes(size))
+            blocks = []
+            time_inline = _measure(lambda: payload_to_inline(payload), data_from_inline)
+            time_smh = _measure(_send_smh, data_from_smh)
+            for block in blocks:
+                allocator.release(block)
+            if time_smh < time_inline:
+                return size
+            size *= 4
+    finally:
+        queue.close()
+        queue.join_thread()
+    return max_bytes
+
+
+# upper bound of the ring of a channel, larger descriptors are spilled
+MAX_CHANNEL_BYTES = 64 * 1024 * 1024
+# pickled size of one ack in a coalesced list, with room to spare
+ACK_BYTES = 64
+
+
+def _create_queue(channel_slots: int, payload_bytes: int = 0, maxsize: int = 0):
+    if not channel_slots:
+        return mp.Queue(maxsize)
+    # descriptors of inline messages carry their payload, coalesced acks travel
+    # as one list
+    slot_size = min(payload_bytes + 512, MAX_CHANNEL_BYTES // channel_slots)
+    return SharedMemoryChannel(channel_slots, max(512, slot_size))
+
+
+class _Options(NamedTuple):
+    # options every factory takes, a new one is added here and handed on to the
+    # senders or the receivers below
+    pool_max_bytes: int = None
+    pool_idle_timeout: float = 10.0
+    arena_size: int = None
+    inline_threshold: int = 0
+    inline_capacity: int = 256
+    channel_slots: int = None
+    batch_capacity: str = "item"
+    max_bytes: int = None
+    oversize: str = "raise"
+    ack_batch: int = 1
+    ack_interval: float = None
+    metrics: bool = False
+    trace: bool = False
+    liveness_interval: float = None
+    chunk_size: int = None
+    stream_window: int = 4
+    attach_cache_bytes: int = None
+    prefetch: int = 0
+    prefetch_bytes: int = None
+    put_workers: int = 1
+    put_depth: int = 4
+    huge_pages: bool = False
+    prefault: bool = False
+
+    def sender_options(self) -> dict:
+        return dict(
+            pool_max_bytes=self.pool_max_bytes,
+            pool_idle_timeout=self.pool_idle_timeout,
+            arena_size=self.arena_size,
+            inline_threshold=self.inline_threshold,
+            batch_capacity=self.batch_capacity,
+            max_bytes=self.max_bytes,
+            oversize=self.oversize,
+            metrics=self.metrics,
+            trace=self.trace,
+            liveness_interval=self.liveness_interval,
+            chunk_size=self.chunk_size,
+            stream_window=self.stream_window,
+            report_unlinked=bool(self.attach_cache_bytes),
+            put_workers=self.put_workers,
+            put_depth=self.put_depth,
+            huge_pages=self.huge_pages,
+            prefault=self.prefault,
+        )
+
+    def receiver_options(self) -> dict:
+        return dict(
+            ack_batch=self.ack_batch,
+            ack_interval=self.ack_interval,
+            metrics=self.metrics,
+            trace=self.trace,
+            attach_cache_bytes=self.attach_cache_bytes,
+            prefetch=self.prefetch,
+            prefetch_bytes=self.prefetch_bytes,
+        )
+
+    def data_queue(self, capacity, producers: int = 1):
+        maxsize = 0
+        if self.inline_threshold and not self.channel_slots:
+            # inline messages aren't acknowledged, the queue bounds them instead.
+            # it has room for the descriptors capacity and the stream windows
+            # allow, inline messages take at most inline_capacity more
+            streams = producers * self.stream_window
+            maxsize = (capacity or 0) + streams + self.inline_capacity
+        return _create_queue(self.channel_slots, self.inline_threshold, maxsize)
+
+    def ack_queue(self):
+        return _create_queue(self.channel_slots, self.ack_batch * ACK_BYTES)
+
+
+def _parse_options(options: dict) -> _Options:
+    # unknown names raise a TypeError like any other unexpected keyword
+    options = _Options(**options)
+    if options.inline_threshold == "auto":
+        options = options._replace(inline_threshold=calibrate_inline_threshold())
+    return options
+
+
+def create_shared_memory_pair(capacity, **options):
+    options = _parse_options(options)
+    data_queue = options.data_queue(capacity)
+    ack_queue = options.ack_queue()
+    receivers = LivenessRegistry() if options.liveness_interval else None
+
+    sender = SharedMemorySender(
+        capacity, data_queue, ack_queue, receivers=receivers, **options.sender_options()
+    )
+    receiver = SharedMemoryReceiver(
+        data_queue, ack_queue, liveness=receivers, **options.receiver_options()
+    )
     return sender, receiver
+
+
+def create_broadcast_group(
+    subscribers: int, capacity, policy: str = "block", **options
+):
+    options = _parse_options(options)
+    data_queues = [options.data_queue(capacity) for _ in range(subscribers)]
+    # acks of all subscribers share one queue
+    ack_queue = options.ack_queue()
+    receivers = (
+        [LivenessRegistry() for _ in range(subscribers)]
+        if options.liveness_interval
+        else None
+    )
+
+    sender = BroadcastSender(
+        capacity,
+        data_queues,
+        ack_queue,
+        policy,
+        receivers=receivers,
+        **options.sender_options(),
+    )
+    return sender, [
+        SharedMemoryReceiver(
+            data_queue,
+            ack_queue,
+            subscriber,
+            liveness=receivers[subscriber] if receivers else None,
+            **options.receiver_options(),
+        )
+        for subscriber, data_queue in enumerate(data_queues)
+    ]
+
+
+def create_multi_producer_pair(producers: int, capacity, **options):
+    options = _parse_options(options)
+    # producers share the data queue, acks go back to each producer separately
+    data_queue = options.data_queue(capacity, producers)
+    ack_queues = [options.ack_queue() for _ in range(producers)]
+    shared_capacity = mp.Semaphore(capacity) if capacity else None
+    max_bytes = options.max_bytes
+    shared_budget = (
+        ByteBudget(max_bytes, options.oversize, shared=True) if max_bytes else None
+    )
+    receivers = (
+        LivenessRegistry(producers=producers) if options.liveness_interval else None
+    )
+
+    senders = [
+        SharedMemorySender(
+            capacity,
+            data_queue,
+            ack_queue,
+            producer=producer,
+            shared_capacity=shared_capacity,
+            shared_budget=shared_budget,
+            receivers=receivers,
+            **options.sender_options(),
+        )
+        for producer, ack_queue in enumerate(ack_queues)
+    ]
+    receiver = SharedMemoryReceiver(
+        data_queue, ack_queues, liveness=receivers, **options.receiver_options()
+    )
+    return senders, receiver
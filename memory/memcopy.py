@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import sysconfig
+import ctypes
+import sys
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# a single thread rarely saturates the memory bandwidth of a host, copies of at
+# least min_bytes are split into one part per thread. ctypes.memmove releases
+# the GIL, the parts are copied at the same time. numpy is needed to get at the
+# addresses of read-only buffers, without it every copy takes one thread
+_threads: int = min(8, os.cpu_count() or 1)
+_min_bytes: int = 16 * 1024 * 1024
+# parts start at page boundaries, threads don't fault in the same pages
+_PAGE = 4096
+
+_executor: ThreadPoolExecutor = None
+_executor_pid: int = None
+
+
+def _bytes_allocator():
+    # PyBytes_FromStringAndSize(NULL, n) returns an uninitialized bytes object
+    # which C code fills in before anyone else sees it, unpickling bytes(buffer)
+    # then returns it as it is. only trusted on CPython builds with a GIL and
+    # once a probe round trips, elsewhere copies go into bytearrays
+    if sys.implementation.name != "cpython" or sysconfig.get_config_var(
+        "Py_GIL_DISABLED"
+    ):
+        return None
+    try:
+        new_bytes = ctypes.pythonapi["PyBytes_FromStringAndSize"]
+        new_bytes.restype = ctypes.py_object
+        new_bytes.argtypes = (ctypes.c_char_p, ctypes.c_ssize_t)
+        probe = new_bytes(None, 8)
+        ctypes.memmove(ctypes.c_char_p(probe), b"probe123", 8)
+    except (AttributeError, TypeError, ctypes.ArgumentError):
+        return None
+    if type(probe) is not bytes or probe != b"probe123":
+        return None
+    return new_bytes
+
+
+_new_bytes = _bytes_allocator()
+
+
+def configure_parallel_copy(threads: int = None, min_bytes: int = None):
+    # per process, affects the senders and receivers created in it as well
+    global _threads, _min_bytes, _executor
+    if threads is not None:
+        _threads = max(1, threads)
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+    if min_bytes is not None:
+        _min_bytes = min_bytes
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    # threads of the parent don't exist in a forked child
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(_threads - 1, thread_name_prefix="memcopy")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _is_parallel(nbytes: int) -> bool:
+    return np is not None and _threads > 1 and nbytes >= _min_bytes
+
+
+def _copy_parallel(dst, src, nbytes: int):
+    # addresses are taken here, workers get plain integers and hold no buffer
+    # exports which would keep a segment from being closed
+    dst_address = np.frombuffer(dst, np.uint8).ctypes.data
+    src_address = np.frombuffer(src, np.uint8).ctypes.data
+    part = -(-nbytes // _threads // _PAGE) * _PAGE
+    executor = _get_executor()
+    futures = [
+        executor.submit(
+            ctypes.memmove,
+            dst_address + start,
+            src_address + start,
+            min(part, nbytes - start),
+        )
+        for start in range(part, nbytes, part)
+    ]
+    ctypes.memmove(dst_address, src_address, min(part, nbytes))
+    for future in futures:
+        future.result()
+
+
+def copy_into(dst: memoryview, src):
+    # dst[:] = src for byte buffers of the same size
+    nbytes = len(dst)
+    if not _is_parallel(nbytes):
+        dst[:] = src
+        return
+    _copy_parallel(dst, src, nbytes)
+
+
+def new_buffer(nbytes: int) -> tuple[any, memoryview]:
+    # room for a private copy and a writable view it is filled in through before
+    # the buffer is used, bytes where they can be filled in place
+    if _new_bytes is None or not nbytes:
+        buffer = bytearray(nbytes)
+        return buffer, memoryview(buffer)
+    buffer = _new_bytes(None, nbytes)
+    address = ctypes.cast(ctypes.c_char_p(buffer), ctypes.c_void_p).value
+    view = memoryview((ctypes.c_char * nbytes).from_address(address)).cast("B")
+    return buffer, view
+
+
+def copy_out(src: memoryview):
+    # bytes(src), the threads fault in the pages of their parts. a bytearray
+    # where bytes can't be filled in place, unpickled bytes take a copy then
+    nbytes = len(src)
+    if not _is_parallel(nbytes):
+        return bytes(src)
+    dst, view = new_buffer(nbytes)
+    _copy_parallel(view, src, nbytes)
+    view.release()
+    return dst
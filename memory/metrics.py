@@ -0,0 +1,92 @@
+from collections import deque
+import threading as th
+import itertools
+import time
+import os
+
+# histogram bucket i holds durations below 2**i nanoseconds
+_BUCKETS = 64
+# shared by all senders of a process
+_message_ids = itertools.count(1)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total_ns", "max_ns")
+
+    def __init__(self):
+        self.counts: list[int] = [0] * _BUCKETS
+        self.count: int = 0
+        self.total_ns: int = 0
+        self.max_ns: int = 0
+
+    def record(self, ns: int):
+        self.counts[min(ns.bit_length(), _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def _percentile(self, fraction: float) -> float:
+        # upper bound of the bucket holding the percentile
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(1 << i, self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total_s": self.total_ns / 1e9,
+            "mean_s": self.total_ns / self.count / 1e9,
+            "max_s": self.max_ns / 1e9,
+            "p50_s": self._percentile(0.5),
+            "p90_s": self._percentile(0.9),
+            "p99_s": self._percentile(0.99),
+            # upper bound in seconds -> count, empty buckets left out
+            "buckets": {(1 << i) / 1e9: c for i, c in enumerate(self.counts) if c},
+        }
+
+
+class Metrics:
+    # opt-in timings and counters of one sender or receiver, every stage gets a
+    # log2 histogram so recording stays a handful of integer operations
+
+    def __init__(self, trace: bool = False, trace_limit: int = 100_000):
+        self.stages: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        # latest spans as (stage, start ns, end ns, message id, thread id)
+        self.spans: deque = deque(maxlen=trace_limit) if trace else None
+
+    def next_message_id(self) -> str:
+        # unique across processes, None unless tracing
+        if self.spans is None:
+            return None
+        return f"{os.getpid()}.{next(_message_ids)}"
+
+    def record(self, stage: str, start_ns: int, message_id: str = None) -> int:
+        # returns the end of the stage, the start of the next one
+        now = time.perf_counter_ns()
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.record(now - start_ns)
+        if self.spans is not None:
+            self.spans.append((stage, start_ns, now, message_id, th.get_native_id()))
+        return now
+
+    def add(self, counter: str, value: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "stages": {
+                stage: histogram.snapshot()
+                for stage, histogram in list(self.stages.items())
+            },
+        }
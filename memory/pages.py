@@ -0,0 +1,53 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+import mmap
+import sys
+import os
+
+# advice of Linux 5.14+, faults in all pages of a range writable in one call
+MADV_POPULATE_WRITE = getattr(
+    mmap, "MADV_POPULATE_WRITE", 23 if sys.platform == "linux" else None
+)
+MADV_HUGEPAGE = getattr(mmap, "MADV_HUGEPAGE", None)
+# transparent huge pages of shared memory are 2MB on every common platform,
+# smaller segments can't use them
+HUGE_PAGE_SIZE = 2 * 1024 * 1024
+
+
+class SegmentBacking(NamedTuple):
+    # huge_pages asks the kernel to back segments with transparent huge pages,
+    # which needs /sys/kernel/mm/transparent_hugepage/shmem_enabled on advise
+    # or always. prefault allocates and maps every page right away, so copies
+    # don't take a page fault every 4KB. both are skipped where unsupported
+    huge_pages: bool = False
+    prefault: bool = False
+
+
+def _madvise(shm: SharedMemory, advice: int, length: int) -> bool:
+    if advice is None:
+        return False
+    try:
+        shm._mmap.madvise(advice, 0, length)
+    except (AttributeError, OSError):
+        return False
+    return True
+
+
+def prepare_segment(shm: SharedMemory, backing: SegmentBacking, nbytes: int = None):
+    # prefaults the first nbytes only, all of the segment by default. pages are
+    # committed to /dev/shm right away, a pool segment of a larger size class
+    # would otherwise pin memory no message has asked for yet
+    if backing.huge_pages and shm.size >= HUGE_PAGE_SIZE:
+        _madvise(shm, MADV_HUGEPAGE, shm.size)
+    if backing.prefault:
+        nbytes = shm.size if nbytes is None else min(max(nbytes, 1), shm.size)
+        if _madvise(shm, MADV_POPULATE_WRITE, nbytes):
+            return
+        # older kernels, the pages are allocated but still faulted in on first
+        # touch, which is cheap without allocating and zeroing them as well
+        fd = getattr(shm, "_fd", -1)
+        if fd >= 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, nbytes)
+            except OSError:
+                pass
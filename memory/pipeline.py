@@ -0,0 +1,83 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import multiprocessing as mp
+import threading as th
+import time
+
+from .convert import Payload, serialize
+
+
+def _snapshot(payload: Payload) -> Payload:
+    # private copy of everything the pickle stream or the buffers reference, the
+    # producer may modify its data as soon as put_async returns
+    chunks = [
+        chunk if type(chunk) is bytes else bytes(chunk) for chunk in payload.chunks
+    ]
+    return payload._replace(chunks=chunks)
+
+
+class PutPipeline:
+    # runs puts on worker threads so the producer doesn't wait for serializing,
+    # copying or free capacity. workers serialize in parallel, the rest of a put
+    # happens in submission order, so messages arrive in that order too
+
+    def __init__(self, sender, workers: int = 1, depth: int = 4):
+        self.sender = sender
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="put_async")
+        # puts submitted but not done yet, put_async waits once there are depth
+        self.has_room = th.Semaphore(depth)
+        self.turns = th.Condition()
+        self.submitted: int = 0
+        self.sending: int = 0
+
+    def submit(self, data, batch: int, timeout: float, immutable: bool) -> Future:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self.has_room.acquire(True, timeout):
+            raise mp.queues.Full
+
+        try:
+            payload = None
+            if not immutable:
+                payload = _snapshot(serialize(data))
+                data = None
+            with self.turns:
+                # numbered and queued together, workers start in this order
+                turn = self.submitted
+                self.submitted += 1
+                return self.executor.submit(
+                    self._put, turn, data, payload, batch, deadline
+                )
+        except BaseException:
+            self.has_room.release()
+            raise
+
+    def _put(self, turn: int, data, payload: Payload, batch: int, deadline: float):
+        error = None
+        try:
+            if payload is None:
+                payload = serialize(data)
+                data = None
+        except BaseException as e:
+            # raised once it is this put's turn, later ones must not wait for it
+            error = e
+
+        with self.turns:
+            while self.sending != turn:
+                self.turns.wait()
+        try:
+            if error is not None:
+                raise error
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            self.sender._put(None, batch, True, timeout, payload)
+        finally:
+            with self.turns:
+                self.sending += 1
+                self.turns.notify_all()
+            self.has_room.release()
+
+    def drain(self):
+        with self.turns:
+            while self.sending != self.submitted:
+                self.turns.wait()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,117 @@
+from multiprocessing.shared_memory import SharedMemory
+from collections import deque
+import threading as th
+import time
+
+from .allocator import Block, destroy_segment
+from .pages import SegmentBacking
+from .reclaim import create_segment
+
+MIN_SEGMENT_SIZE = 4096
+
+
+def _size_class(size: int) -> int:
+    return max(MIN_SEGMENT_SIZE, 1 << (size - 1).bit_length())
+
+
+class SegmentPool:
+    def __init__(
+        self,
+        max_bytes: int,
+        idle_timeout: float = 10.0,
+        backing: SegmentBacking = None,
+    ):
+        self.max_bytes: int = max_bytes
+        self.idle_timeout: float = idle_timeout
+        # applied once per segment, reused segments keep their pages
+        self.backing: SegmentBacking = backing
+        self.pooled_bytes: int = 0
+
+        # size class -> [(segment, released_at)], oldest first
+        self.free_segments: dict[int, list[tuple[SharedMemory, float]]] = {}
+        # segment name -> [size class, generation]
+        self.segments: dict[str, list[int]] = {}
+        self.lock = th.Lock()
+        # evicts idle segments while the sender doesn't allocate or release any
+        self.timer: th.Timer = None
+        # names of unlinked segments, see SegmentAllocator
+        self.unlinked: deque = None
+
+    def block_size(self, size: int) -> int:
+        return _size_class(size)
+
+    def allocate(self, size: int, block: bool = True, timeout: float = None) -> Block:
+        size_class = _size_class(size)
+        with self.lock:
+            self._evict_idle(time.monotonic())
+            free = self.free_segments.get(size_class)
+            if free:
+                # most recently released first, its pages are still warm
+                shm, _ = free.pop()
+                self.pooled_bytes -= size_class
+                entry = self.segments[shm.name]
+                entry[1] += 1
+                return Block(shm, 0, size_class, entry[1])
+
+            # only the message is prefaulted, the rest of the size class is
+            # faulted in by a larger message reusing the segment
+            shm = create_segment(size_class, self.backing, size)
+            self.segments[shm.name] = [size_class, 0]
+            return Block(shm, 0, size_class)
+
+    def release(self, block: Block):
+        shm = block.shm
+        with self.lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            size_class = self.segments[shm.name][0]
+            if self.pooled_bytes + size_class > self.max_bytes:
+                self._destroy(shm)
+                return
+            self.free_segments.setdefault(size_class, []).append((shm, now))
+            self.pooled_bytes += size_class
+            self._schedule_eviction(now)
+
+    def clear(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for free in self.free_segments.values():
+                for shm, _ in free:
+                    self._destroy(shm)
+            self.free_segments.clear()
+            self.pooled_bytes = 0
+
+    def _evict_idle(self, now: float):
+        for size_class, free in self.free_segments.items():
+            while free and now - free[0][1] >= self.idle_timeout:
+                shm, _ = free.pop(0)
+                self.pooled_bytes -= size_class
+                self._destroy(shm)
+
+    def _schedule_eviction(self, now: float):
+        # called with the lock held, one timer at a time for the oldest segment
+        if self.timer is not None:
+            return
+        released = [free[0][1] for free in self.free_segments.values() if free]
+        if not released:
+            return
+        delay = max(0.0, min(released) + self.idle_timeout - now)
+        self.timer = th.Timer(delay, self._on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _on_timer(self):
+        with self.lock:
+            if self.timer is not th.current_thread():
+                # cancelled by clear meanwhile
+                return
+            self.timer = None
+            now = time.monotonic()
+            self._evict_idle(now)
+            self._schedule_eviction(now)
+
+    def _destroy(self, shm: SharedMemory):
+        self.segments.pop(shm.name, None)
+        destroy_segment(shm, self.unlinked)
@@ -1,23 +1,537 @@
+from multiprocessing.shared_memory import SharedMemory
 from multiprocessing.queues import Queue
+from multiprocessing import util as mp_util
+from collections import deque
+import weakref
+import threading as th
+import queue
+import time
+import os
 
-from .convert import SMInfo, data_from_smh
+from .convert import (
+    SMInfo,
+    CODEC_RAW,
+    chunk_from_smh,
+    data_from_inline,
+    data_from_smh,
+    data_from_smh_zero_copy,
+    stream_buffers,
+    _unpack,
+)
+from .allocator import close_segment
+from .cache import AttachCache
+from .metrics import Metrics
+from .reclaim import LivenessRegistry
+from .sender import _remaining
+
+# results of a streamed chunk other than the complete message
+_INCOMPLETE = object()
+_DISCARDED = object()
+# how often a waiting prefetch thread checks whether it should stop
+_PREFETCH_POLL_INTERVAL = 0.1
+
+
+def _release_lease(shm: SharedMemory, q_ack_out: Queue, ack):
+    if shm is None:
+        # inline message, nothing to give back
+        return
+    q_ack_out.put(ack)
+    close_segment(shm)
+
+
+class SharedMemoryLease:
+    def __init__(self, data, shm: SharedMemory, q_ack_out: Queue, ack):
+        self.data = data
+        self._finalizer = weakref.finalize(self, _release_lease, shm, q_ack_out, ack)
+
+    @property
+    def released(self) -> bool:
+        return not self._finalizer.alive
+
+    def release(self):
+        # data must not be used afterwards, the sender may reuse the memory
+        self.data = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self.data
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class _PendingAcks:
+    # acks waiting to be sent together, apart from the receiver so they are
+    # still sent once it is garbage collected or its process exits
+
+    def __init__(self, q_ack_out: Queue):
+        self.q_ack_out: Queue = q_ack_out
+        self.lock: th.Lock = th.Lock()
+        # producer -> acks not sent yet
+        self.acks: dict[int, list] = {}
+        self.count: int = 0
+        self.timer: th.Timer = None
+
+    def add(self, producer: int, ack, batch: int, interval: float):
+        with self.lock:
+            self.acks.setdefault(producer, []).append(ack)
+            self.count += 1
+            is_full = self.count >= batch
+            if not is_full and interval is not None and self.timer is None:
+                # sent in time even while the receiver is busy with the data
+                self.timer = th.Timer(interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            acks, self.acks = self.acks, {}
+            self.count = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        for producer, pending in acks.items():
+            if isinstance(self.q_ack_out, list):
+                self.q_ack_out[producer].put(pending)
+            else:
+                self.q_ack_out.put(pending)
+
+
+class _Stream:
+    # message being reassembled from its chunks
+    __slots__ = ("info", "buffer", "buffers", "regions", "offset", "index")
+
+    def __init__(self, info: SMInfo):
+        # descriptor of the first chunk, the only one with the buffer lengths
+        self.info: SMInfo = info
+        # raw streams have an unknown size and grow with every chunk, the
+        # buffers of serialized ones are sized up front
+        self.buffer: bytearray = None
+        self.buffers: list = None
+        self.regions: list = None
+        if info.buffer_lengths:
+            self.buffers, self.regions = stream_buffers(info.buffer_lengths)
+        else:
+            self.buffer = bytearray()
+        self.offset: int = 0
+        self.index: int = 0
 
 
 class SharedMemoryReceiver:
-    def __init__(self, q_data_in: Queue, q_ack_out: Queue):
+    def __init__(
+        self,
+        q_data_in: Queue,
+        q_ack_out: Queue,
+        subscriber: int = None,
+        ack_batch: int = 1,
+        ack_interval: float = None,
+        metrics: bool = False,
+        trace: bool = False,
+        liveness: LivenessRegistry = None,
+        attach_cache_bytes: int = None,
+        prefetch: int = 0,
+        prefetch_bytes: int = None,
+    ):
         self.q_data_in: Queue = q_data_in
+        # a list holds one ack queue per producer
         self.q_ack_out: Queue = q_ack_out
+        # index within a broadcast group, sent along with every ack
+        self.subscriber: int = subscriber
+        # remaining items of a received batch
+        self.pending: deque = deque()
+        # descriptors of other producers which arrived in the middle of a stream
+        self.deferred: deque = deque()
+        self.stream: _Stream = None
+
+        # acks are sent together once this many are pending or the oldest is
+        # ack_interval seconds old, and always before the receiver waits for data
+        self.ack_batch: int = ack_batch
+        self.ack_interval: float = ack_interval
+        # set up by the first coalesced ack of the consuming process, which
+        # also flushes them when it exits
+        self.pending_acks: _PendingAcks = None
+        self.pending_acks_pid: int = None
+        # per stage timings and counters, see stats(), trace also keeps the spans
+        self.metrics: Metrics = Metrics(trace) if metrics or trace else None
+        # every process calling get registers with the sender, which takes back
+        # the unacknowledged segments once all of them died
+        self.liveness: LivenessRegistry = liveness
+        self.registered_pid: int = None
+        # mappings of reused segments kept open, up to this many bytes
+        self.attach_cache: AttachCache = (
+            AttachCache(attach_cache_bytes) if attach_cache_bytes else None
+        )
+
+        # a background thread receives up to prefetch messages ahead, holding
+        # at most prefetch_bytes of them (and one more message) in memory, get
+        # then only takes the next one. it is started by the first get of the
+        # consuming process and owns all of the state above from then on
+        self.prefetch: int = prefetch
+        self.prefetch_bytes: int = prefetch_bytes
+        self.received_bytes: int = 0
+        self.prefetch_pid: int = None
+        self.prefetch_thread: th.Thread = None
+        self.prefetch_running: bool = False
+        # (data, bytes, error) in order of arrival
+        self.ready: deque = None
+        self.ready_bytes: int = 0
+        self.ready_changed: th.Condition = None
+
+    def _ack_queue(self, info: SMInfo) -> Queue:
+        if isinstance(self.q_ack_out, list):
+            return self.q_ack_out[info.producer]
+        return self.q_ack_out
+
+    def _send_ack(self, info: SMInfo):
+        if self.ack_batch <= 1:
+            self._ack_queue(info).put(self._ack(info))
+            return
+
+        pid = os.getpid()
+        if self.pending_acks_pid != pid:
+            # acks inherited from a parent process aren't ours to send
+            self.pending_acks = _PendingAcks(self.q_ack_out)
+            self.pending_acks_pid = pid
+            # runs when the receiver is garbage collected and at exit, also of
+            # processes started by multiprocessing, which skip atexit. ahead of
+            # the finalizers of the ack queue, which stop its feeder thread
+            mp_util.Finalize(self, self.pending_acks.flush, exitpriority=20)
+        self.pending_acks.add(
+            info.producer, self._ack(info), self.ack_batch, self.ack_interval
+        )
+
+    def _pending_ack_count(self) -> int:
+        if self.pending_acks_pid != os.getpid():
+            return 0
+        return self.pending_acks.count
+
+    def flush_acks(self):
+        if self._pending_ack_count():
+            self.pending_acks.flush()
+
+    def close(self):
+        # sends what is still pending, the receiver can't be used afterwards
+        self.stop_prefetch()
+        self.flush_acks()
+        if self.attach_cache is not None:
+            self.attach_cache.clear()
+
+    def _ack(self, info: SMInfo):
+        if self.subscriber is None:
+            return info.key
+        return info.key, self.subscriber
 
     def _process_info(self, info: SMInfo):
         assert info, "No info received"
-        data = data_from_smh(info)
-        self.q_ack_out.put(info.smh_name)
+        if info.inline is not None:
+            data = data_from_inline(info, self.metrics)
+        else:
+            data = data_from_smh(info, self.metrics, self.attach_cache)
+            self._send_ack(info)
+        if info.batch:
+            self.pending.extend(data[1:])
+            return data[0]
         del info
         return data
 
-    def get_nowait(self):
-        return self.get(block=False)
+    def _process_info_zero_copy(self, info: SMInfo) -> SharedMemoryLease:
+        assert info, "No info received"
+        if info.inline is not None or info.batch:
+            # batch items are handed out one by one, they can't share a mapping
+            return SharedMemoryLease(self._process_info(info), None, None, None)
+        data, shm = data_from_smh_zero_copy(info, self.metrics)
+        q_ack_out = self._ack_queue(info)
+        return SharedMemoryLease(data, shm, q_ack_out, self._ack(info))
+
+    def get_nowait(self, zero_copy: bool = False):
+        return self.get(block=False, zero_copy=zero_copy)
+
+    def _register(self):
+        if self.liveness is not None:
+            pid = os.getpid()
+            if pid != self.registered_pid:
+                self.liveness.register(pid)
+                self.registered_pid = pid
+
+    def _get_info(self, block: bool, timeout: float) -> SMInfo:
+        info = None
+        if self._pending_ack_count():
+            try:
+                info = self.q_data_in.get(False)
+            except queue.Empty:
+                # the sender may be waiting for them to free capacity
+                self.flush_acks()
+        if info is None:
+            info = self.q_data_in.get(block, timeout)
+        if self.liveness is not None:
+            self.liveness.record_taken(info.producer)
+        self.received_bytes += info.total_bytes
+        if info.unlinked and self.attach_cache is not None:
+            self.attach_cache.invalidate(info.unlinked)
+        return info
+
+    def _dequeue(self, block: bool, timeout: float) -> SMInfo:
+        if self.deferred:
+            return self.deferred.popleft()
+        return self._get_info(block, timeout)
+
+    def _next_chunk(self, producer: int, block: bool, deadline: float) -> SMInfo:
+        # chunks of one producer arrive in order, descriptors of others wait
+        for i, info in enumerate(self.deferred):
+            if info.producer == producer:
+                del self.deferred[i]
+                return info
+        while True:
+            info = self._get_info(block, _remaining(deadline))
+            if info.producer == producer:
+                return info
+            self.deferred.append(info)
+
+    def _process_chunk(self, info: SMInfo):
+        stream = self.stream
+        if info.chunk is not None and info.chunk[0] == 0:
+            stream = self.stream = _Stream(info)
+        elif (
+            stream is None
+            or info.chunk is None
+            or info.producer != stream.info.producer
+            or info.chunk[0] != stream.index
+        ):
+            # part of the stream got lost, e.g. dropped by a broadcast sender
+            self.stream = None
+            if info.chunk is None:
+                self.deferred.appendleft(info)
+            elif info.smh_name is not None:
+                self._send_ack(info)
+            return _DISCARDED
+
+        if stream.regions is not None:
+            chunk_from_smh(info, stream.regions, stream.offset, self.attach_cache)
+        else:
+            chunk_from_smh(info, stream.buffer, None, self.attach_cache)
+        if info.smh_name is not None:
+            # frees a slot of the stream window right away
+            self._send_ack(info)
+        if self.metrics:
+            self.metrics.add("chunks")
+            self.metrics.add("bytes", info.total_bytes)
+        stream.offset += info.total_bytes
+        stream.index += 1
+        if not info.chunk[1]:
+            return _INCOMPLETE
+
+        self.stream = None
+        first = stream.info
+        if stream.buffers is None:
+            return stream.buffer
+        for _, view in stream.regions:
+            view.release()
+        data = _unpack(stream.buffers, first.codec)
+        if first.batch:
+            self.pending.extend(data[1:])
+            return data[0]
+        return data
+
+    def _receive_stream(self, info: SMInfo, block: bool, deadline: float):
+        # a stream interrupted by a timeout is continued by the next get
+        while True:
+            data = self._process_chunk(info)
+            if data is not _INCOMPLETE:
+                return data
+            info = self._next_chunk(info.producer, block, deadline)
+
+    def get(self, block: bool = True, timeout: float = None, zero_copy: bool = False):
+        if not self.prefetch and not self.ready:
+            return self._get(block, timeout, zero_copy)
+        # prefetched data is a private copy, a lease has nothing to release
+        data = self._take_prefetched(block, timeout)
+        if zero_copy:
+            return SharedMemoryLease(data, None, None, None)
+        return data
+
+    def _start_prefetch(self):
+        pid = os.getpid()
+        if self.prefetch_pid == pid:
+            return
+        self.prefetch_pid = pid
+        self.ready = deque()
+        self.ready_bytes = 0
+        self.ready_changed = th.Condition()
+        self.prefetch_running = True
+        self.prefetch_thread = th.Thread(target=self._prefetch_loop, daemon=True)
+        self.prefetch_thread.start()
+
+    def stop_prefetch(self):
+        # messages already prefetched are handed out first, get receives the
+        # following ones itself
+        self.prefetch = 0
+        if self.prefetch_thread is None:
+            return
+        self.prefetch_running = False
+        with self.ready_changed:
+            self.ready_changed.notify_all()
+        self.prefetch_thread.join()
+        self.prefetch_thread = None
+
+    def _has_room(self) -> bool:
+        if not self.ready:
+            return True
+        if len(self.ready) >= self.prefetch:
+            return False
+        return not self.prefetch_bytes or self.ready_bytes < self.prefetch_bytes
+
+    def _prefetch_loop(self):
+        ready_changed = self.ready_changed
+        while self.prefetch_running:
+            with ready_changed:
+                while self.prefetch_running and not self._has_room():
+                    ready_changed.wait()
+            if not self.prefetch_running:
+                return
+
+            received_bytes = self.received_bytes
+            try:
+                item = (self._get(True, _PREFETCH_POLL_INTERVAL), None)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                # raised by the get which would have returned this message
+                item = (None, e)
+            # a batch is accounted for with its first item
+            nbytes = self.received_bytes - received_bytes
+            with ready_changed:
+                self.ready.append((*item, nbytes))
+                self.ready_bytes += nbytes
+                ready_changed.notify_all()
+
+    def _take_prefetched(self, block: bool, timeout: float):
+        if self.prefetch:
+            self._start_prefetch()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.ready_changed:
+            while not self.ready:
+                remaining = _remaining(deadline)
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self.ready_changed.wait(remaining)
+            data, error, nbytes = self.ready.popleft()
+            self.ready_bytes -= nbytes
+            self.ready_changed.notify_all()
+        if error is not None:
+            raise error
+        return data
+
+    def _get(self, block: bool = True, timeout: float = None, zero_copy: bool = False):
+        if self.pending:
+            data = self.pending.popleft()
+            if zero_copy:
+                return SharedMemoryLease(data, None, None, None)
+            return data
+
+        self._register()
+        metrics = self.metrics
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if metrics:
+                start = time.perf_counter_ns()
+            info: SMInfo = self._dequeue(block, _remaining(deadline))
+            if info.chunk is None:
+                break
+            data = self._receive_stream(info, block, deadline)
+            if data is _DISCARDED:
+                continue
+            if metrics:
+                metrics.add("messages")
+                metrics.add("items", info.batch or 1)
+                metrics.record("get", start, info.message_id)
+            if zero_copy:
+                return SharedMemoryLease(data, None, None, None)
+            return data
+
+        if not metrics:
+            if zero_copy:
+                return self._process_info_zero_copy(info)
+            return self._process_info(info)
+
+        metrics.record("dequeue", start, info.message_id)
+        metrics.add("messages")
+        metrics.add("items", info.batch or 1)
+        metrics.add("bytes", info.total_bytes)
+        if info.inline is not None:
+            metrics.add("inline_messages")
+        if zero_copy:
+            data = self._process_info_zero_copy(info)
+        else:
+            data = self._process_info(info)
+        metrics.record("get", start, info.message_id)
+        return data
+
+    def get_stream(self, timeout: float = None):
+        # next message sent by put_stream as an iterator over its chunks, views
+        # into shared memory which are only valid until the next one is requested
+        if self.prefetch:
+            raise ValueError("get_stream is not available with prefetch, use get.")
+        if self.pending:
+            raise ValueError("Next message is not a stream, use get.")
+        self._register()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        info: SMInfo = self._dequeue(True, timeout)
+        if info.chunk is None or info.chunk[0] != 0 or info.codec != CODEC_RAW:
+            self.deferred.appendleft(info)
+            raise ValueError("Next message is not a stream, use get.")
+        return self._iter_stream(info, deadline)
+
+    def _iter_stream(self, info: SMInfo, deadline: float):
+        index = 0
+        while True:
+            if info.smh_name is not None:
+                cache = self.attach_cache
+                if cache is not None:
+                    shm = cache.attach(info.smh_name)
+                else:
+                    shm = SharedMemory(name=info.smh_name)
+                view = shm.buf[info.offset : info.offset + info.total_bytes]
+                try:
+                    yield view
+                finally:
+                    try:
+                        view.release()
+                    except BufferError:
+                        # the chunk is still referenced, it keeps the mapping
+                        pass
+                    if cache is None:
+                        close_segment(shm)
+                    self._send_ack(info)
+            if info.chunk[1]:
+                return
+            index += 1
+            info = self._next_chunk(info.producer, True, deadline)
+            if info.chunk is None or info.chunk[0] != index:
+                self.deferred.appendleft(info)
+                raise ValueError("Stream was interrupted.")
+
+    def stats(self) -> dict:
+        stats = self.metrics.snapshot() if self.metrics else {}
+        stats["pending_items"] = len(self.pending)
+        stats["pending_acks"] = self._pending_ack_count()
+        if self.attach_cache is not None:
+            stats.update(self.attach_cache.stats())
+        if self.ready is not None:
+            stats["prefetched_items"] = len(self.ready)
+            stats["prefetched_bytes"] = self.ready_bytes
+        return stats
 
-    def get(self, block: bool = True, timeout: float = None):
-        info: SMInfo = self.q_data_in.get(block, timeout)
-        return self._process_info(info)
+    def get_many(
+        self, max_items: int, timeout: float = None, zero_copy: bool = False
+    ) -> list:
+        # waits for the first item only, then takes whatever else is available
+        items = [self.get(timeout=timeout, zero_copy=zero_copy)]
+        while len(items) < max_items:
+            try:
+                items.append(self.get(block=False, zero_copy=zero_copy))
+            except queue.Empty:
+                break
+        return items
@@ -0,0 +1,142 @@
+from multiprocessing.shared_memory import SharedMemory
+import multiprocessing as mp
+import threading as th
+import secrets
+import os
+
+from .pages import SegmentBacking, prepare_segment
+
+# segments are named <prefix><owner pid>_<random>, so the owner of a leftover
+# segment can be told from its name alone
+SEGMENT_PREFIX = "smq_"
+SHM_DIR = "/dev/shm"
+
+
+def _is_alive(pid: int) -> bool:
+    # a reused pid keeps segments around a bit longer, it never frees them early
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def create_segment(
+    size: int, backing: SegmentBacking = None, nbytes: int = None
+) -> SharedMemory:
+    while True:
+        name = f"{SEGMENT_PREFIX}{os.getpid()}_{secrets.token_hex(4)}"
+        try:
+            shm = SharedMemory(name=name, create=True, size=size)
+            break
+        except FileExistsError:
+            pass
+    if backing is not None:
+        prepare_segment(shm, backing, nbytes)
+    return shm
+
+
+def segment_owner(name: str) -> int:
+    # pid of the process which created the segment, None for foreign segments
+    if not name.startswith(SEGMENT_PREFIX):
+        return None
+    pid, _, _ = name[len(SEGMENT_PREFIX) :].partition("_")
+    return int(pid) if pid.isdigit() else None
+
+
+def reclaim_orphaned_segments(directory: str = SHM_DIR) -> list[str]:
+    # unlinks segments whose owner is gone, processes still mapping them keep
+    # their data, returns the names of the reclaimed segments
+    if not os.path.isdir(directory):
+        return []
+
+    reclaimed = []
+    for name in os.listdir(directory):
+        pid = segment_owner(name)
+        if pid is None or _is_alive(pid):
+            continue
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            # reclaimed by someone else in the meantime
+            continue
+        reclaimed.append(name)
+    return reclaimed
+
+
+class SegmentSweeper:
+    # reclaims orphaned segments every interval seconds in a background thread
+
+    def __init__(self, interval: float = 60.0, directory: str = SHM_DIR):
+        self.interval: float = interval
+        self.directory: str = directory
+        self.reclaimed: int = 0
+        self.stopped = th.Event()
+        self.thread: th.Thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = th.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.reclaimed += len(reclaim_orphaned_segments(self.directory))
+            except Exception as e:
+                print(f"SegmentSweeper error: {e}")
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+class LivenessRegistry:
+    # pids of the processes receiving from a channel, the sender takes back the
+    # segments of unacknowledged messages they took once all of them are gone
+
+    def __init__(self, slots: int = 16, producers: int = 1):
+        self.pids = mp.Array("i", slots)
+        # descriptors taken from the channel per producer, which sends and numbers
+        # them in the same order, the ones after them are still queued
+        self.taken = mp.Array("q", producers)
+
+    def register(self, pid: int = None):
+        pid = pid or os.getpid()
+        with self.pids.get_lock():
+            pids = self.pids
+            if pid in pids[:]:
+                return
+            for i, other in enumerate(pids):
+                if not other or not _is_alive(other):
+                    pids[i] = pid
+                    return
+        # every slot is taken by a live process, one of them stands in for it
+
+    def record_taken(self, producer: int = None):
+        with self.taken.get_lock():
+            self.taken[producer or 0] += 1
+
+    def taken_count(self, producer: int = None) -> int:
+        return self.taken[producer or 0]
+
+    def is_dead(self) -> bool:
+        # False as long as no receiver registered
+        with self.pids.get_lock():
+            pids = [pid for pid in self.pids if pid]
+        return bool(pids) and not any(_is_alive(pid) for pid in pids)
@@ -1,36 +1,258 @@
 import multiprocessing as mp
 import threading as th
+from collections import deque
+import queue
+from typing import NamedTuple
+from concurrent.futures import Future
+import itertools
+import weakref
 import atexit
+import math
+import time
+import os
 
-from .convert import data_to_smh
+from .allocator import Block, SegmentAllocator
+from .arena import SharedMemoryArena
+from .budget import ByteBudget
+from .metrics import Metrics
+from .convert import (
+    SMInfo,
+    Payload,
+    payload_to_inline,
+    payload_to_smh,
+    reserve_payload,
+    serialize,
+    split_chunks,
+    CODEC_RAW,
+    _memoryview_from_buffer,
+    _ndarray_from_buffer,
+)
+from .pages import SegmentBacking
+from .pipeline import PutPipeline
+from .pool import SegmentPool
+from .reclaim import LivenessRegistry, _is_alive
+
+# chunk size of put_stream unless the sender has one configured
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# unlinked segments named per descriptor, the rest follow with the next ones
+MAX_UNLINKED_NAMES = 8
+
+
+def _remaining(deadline: float) -> float:
+    if deadline is None:
+        return None
+    return max(0, deadline - time.monotonic())
+
+
+class _OpenHandle(NamedTuple):
+    block: Block
+    # capacity slots held until the message is acknowledged
+    slots: int
+    # bytes held in the byte budget
+    nbytes: int = 0
+    # perf_counter_ns when the descriptor was handed off, with metrics enabled
+    sent_at: int = 0
+    message_id: str = None
+    # streamed chunk, holds a slot of the stream window
+    chunk: bool = False
+
+
+def _abort_reservation(
+    sender: "SharedMemorySender", key: tuple[str, int], holder: list
+):
+    # drops the reservation's reference to its data first, the segment can't be
+    # closed while a view or an array of it is alive
+    holder[0] = None
+    if not sender.is_closed:
+        sender._close_handle(key)
+
+
+class SharedMemoryReservation:
+    # region of a segment holding capacity like a put, filled in place by the
+    # producer and handed to the receiver on commit without pickling or copying.
+    # one dropped without commit or abort is aborted once it is garbage collected
+
+    def __init__(self, sender: "SharedMemorySender", info: SMInfo, data):
+        self.sender: SharedMemorySender = sender
+        self.info: SMInfo = info
+        # shared with the finalizer, which must not reference the reservation
+        self._holder: list = [data]
+        self.is_open = True
+        self._finalizer = weakref.finalize(
+            self, _abort_reservation, sender, info.key, self._holder
+        )
+        # the sender cleans up its handles itself at exit
+        self._finalizer.atexit = False
+
+    @property
+    def data(self):
+        return self._holder[0]
+
+    @data.setter
+    def data(self, data):
+        self._holder[0] = data
+
+    def commit(self, block: bool = True, timeout: float = None):
+        # data must not be written afterwards, the receiver may be reading it
+        if not self.is_open:
+            raise ValueError("Reservation was already committed or aborted.")
+        if self.sender.is_closed:
+            raise BrokenPipeError("Sender is closed.")
+        # on a full channel the reservation stays open, commit can be retried
+        self.sender._enqueue(self.info, block, timeout)
+        self.is_open = False
+        self._finalizer.detach()
+        self._release_data()
+
+    def _release_data(self):
+        if isinstance(self.data, memoryview):
+            # later writes fail instead of corrupting a message
+            self.data.release()
+        self.data = None
+
+    def abort(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self._release_data()
+        self._finalizer()
+
+    def __enter__(self):
+        return self.data
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
 
 
 class SharedMemorySender:
-    def __init__(self, capacity: int, q_data_out: mp.Queue, q_ack_in: mp.Queue):
+    def __init__(
+        self,
+        capacity: int,
+        q_data_out: mp.Queue,
+        q_ack_in: mp.Queue,
+        pool_max_bytes: int = None,
+        pool_idle_timeout: float = 10.0,
+        arena_size: int = None,
+        inline_threshold: int = 0,
+        batch_capacity: str = "item",
+        producer: int = None,
+        shared_capacity: mp.Semaphore = None,
+        max_bytes: int = None,
+        oversize: str = "raise",
+        shared_budget: ByteBudget = None,
+        metrics: bool = False,
+        trace: bool = False,
+        receivers: LivenessRegistry = None,
+        liveness_interval: float = None,
+        chunk_size: int = None,
+        stream_window: int = 4,
+        report_unlinked: bool = False,
+        put_workers: int = 1,
+        put_depth: int = 4,
+        huge_pages: bool = False,
+        prefault: bool = False,
+    ):
         self.q_data_out: mp.Queue = q_data_out
         self.q_ack_in: mp.Queue = q_ack_in
         self.capacity: int = capacity
+        self.pool_max_bytes: int = pool_max_bytes
+        self.pool_idle_timeout: float = pool_idle_timeout
+        self.arena_size: int = arena_size
+        self.inline_threshold: int = inline_threshold or 0
+        assert batch_capacity in ("item", "batch"), "batch_capacity: item or batch"
+        self.batch_capacity: str = batch_capacity
+        # index among the producers of a channel, the receiver routes acks by it
+        self.producer: int = producer
+        # capacity enforced across all producers of a channel
+        self.shared_capacity: mp.Semaphore = shared_capacity
+        # bytes of unacknowledged messages, next to or instead of capacity
+        self.max_bytes: int = max_bytes
+        assert oversize in ("raise", "alone"), "oversize: raise or alone"
+        self.oversize: str = oversize
+        self.shared_budget: ByteBudget = shared_budget
+        # per stage timings and counters, see stats(), trace also keeps the spans
+        self.metrics: Metrics = Metrics(trace) if metrics or trace else None
+        # processes receiving the messages, checked every liveness_interval seconds
+        # if set, once all of them died the segments of messages they took but
+        # didn't ack are taken back
+        self.receivers: LivenessRegistry = receivers if liveness_interval else None
+        self.liveness_interval: float = liveness_interval
+        # descriptors sent so far and the sequence numbers of those still holding a
+        # segment, only counted while receivers are watched
+        self.sent: int = 0
+        self.sequences: dict[tuple[str, int], int] = {}
+        self.send_lock = None
+        # payloads larger than chunk_size are streamed through at most
+        # stream_window segments of chunk_size bytes at a time
+        self.chunk_size: int = chunk_size
+        self.stream_window: int = stream_window
+        # descriptors name the segments unlinked since the previous one, for
+        # receivers caching their mappings
+        self.report_unlinked: bool = report_unlinked
+        # put_async runs on put_workers threads, with at most put_depth puts in flight
+        self.put_workers: int = put_workers
+        self.put_depth: int = put_depth
+        # how new segments are backed, see SegmentBacking
+        self.backing: SegmentBacking = None
+        if huge_pages or prefault:
+            self.backing = SegmentBacking(huge_pages, prefault)
+        # process which owns the ack thread, a second one would steal its acks
+        self.owner_pid = mp.Value("i", 0)
 
         self.is_closed = False
         self.is_initialized = False
 
-        self.open_handles = {}
+        self.open_handles: dict[tuple[str, int], _OpenHandle] = {}
+        self.allocator = None
         self.has_capacity = None
+        self.budget = None
+        self.window = None
         self.is_empty = None
         self.thread_ack_running = True
         self.thread_ack = None
+        self.pipeline: PutPipeline = None
+        # called from the ack thread whenever a segment and its capacity are freed
+        self.release_callbacks: list = []
 
     def _initialize(self):
         if self.is_initialized:
             return
 
+        with self.owner_pid.get_lock():
+            owner_pid = self.owner_pid.value
+            if owner_pid and owner_pid != os.getpid() and _is_alive(owner_pid):
+                raise RuntimeError(
+                    f"Sender is already used by process {owner_pid}, "
+                    "use create_multi_producer_pair for several producers."
+                )
+            self.owner_pid.value = os.getpid()
+
         self.is_initialized = True
         atexit.register(self._cleanup)
 
-        self.has_capacity = th.Semaphore(self.capacity or 0)
+        self.has_capacity = self.shared_capacity or th.Semaphore(self.capacity or 0)
+        self.budget = self.shared_budget
+        if self.budget is None and self.max_bytes:
+            self.budget = ByteBudget(self.max_bytes, self.oversize)
+        self.window = th.Semaphore(self.stream_window)
+        self.send_lock = th.Lock()
         self.is_empty = th.Event()
         self.is_empty.set()
 
+        if self.arena_size:
+            self.allocator = SharedMemoryArena(self.arena_size, self.backing)
+        elif self.pool_max_bytes:
+            self.allocator = SegmentPool(
+                self.pool_max_bytes, self.pool_idle_timeout, self.backing
+            )
+        else:
+            self.allocator = SegmentAllocator(self.backing)
+        if self.report_unlinked:
+            self.allocator.unlinked = deque()
+
         self.thread_ack_running = True
         self.thread_ack = th.Thread(target=self._handle_acks, daemon=True)
         self.thread_ack.start()
@@ -39,73 +261,477 @@ class SharedMemorySender:
         if self.is_closed is not None:
             self.is_closed = True
 
+        if self.pipeline is not None:
+            self.pipeline.shutdown()
+            self.pipeline = None
+
         if self.thread_ack_running is not None:
             self.thread_ack_running = False
-        if self.thread_ack is not None and self.thread_ack.is_alive():
+        if (
+            self.thread_ack is not None
+            and self.thread_ack.is_alive()
+            and self.thread_ack is not th.current_thread()
+        ):
+            try:
+                # wakes up the ack thread blocked on the queue
+                self.q_ack_in.put(None, timeout=1.0)
+            except:
+                pass
             self.thread_ack.join(timeout=1.0)
 
         if self.open_handles is not None:
-            for shm_name in list(self.open_handles.keys()):
+            for key in list(self.open_handles.keys()):
                 try:
-                    self._close_handle(shm_name)
+                    self._close_handle(key)
                 except:
                     pass
             self.open_handles = None
 
+        if self.allocator is not None:
+            self.allocator.clear()
+            self.allocator = None
+
     def __del__(self):
         self._cleanup()
 
-    def _close_handle(self, shm_name: str):
-        smh = self.open_handles.pop(shm_name, None)
-        if smh is None:
+    def _close_handle(self, key: tuple[str, int], notify: bool = True):
+        # notify is False when a put rolls back, nothing a waiter could use was freed
+        handle = self.open_handles.pop(key, None)
+        if handle is None:
             return
+        self.sequences.pop(key, None)
+
+        self.allocator.release(handle.block)
+        self._release(handle.slots, handle.nbytes, handle.chunk)
+        if handle.sent_at and not self.is_closed:
+            self.metrics.record("ack", handle.sent_at, handle.message_id)
         if len(self.open_handles) == 0:
             self.is_empty.set()
+        if notify:
+            for callback in self.release_callbacks:
+                callback()
 
-        smh.close()
-        smh.unlink()
-        if self.capacity:
-            self.has_capacity.release()
+    def _handle_ack(self, ack):
+        self._close_handle(ack)
+
+    def _check_receivers(self):
+        if not self.sequences or not self.receivers.is_dead():
+            return
+        # acks of a crashed receiver never arrive. descriptors are taken in the
+        # order they were sent, those after the taken ones are still queued and
+        # wait for the next process calling get
+        taken = self.receivers.taken_count(self.producer)
+        keys = [
+            key for key, sequence in list(self.sequences.items()) if sequence < taken
+        ]
+        if not keys:
+            return
+        print(f"SharedMemorySender: receiver died, reclaiming {len(keys)} segments")
+        if self.metrics:
+            self.metrics.add("reclaimed", len(keys))
+        for key in keys:
+            self._close_handle(key)
 
     def _handle_acks(self):
+        # without receivers to watch the ack thread only wakes up for acks
+        interval = self.liveness_interval if self.receivers is not None else None
+        next_check = time.monotonic() + (interval or 0)
         while self.thread_ack_running:
             try:
-                ack_smh_name = self.q_ack_in.get(timeout=0.1)
-                self._close_handle(ack_smh_name)
-            except mp.queues.Empty:
-                continue
+                try:
+                    acks = self.q_ack_in.get(timeout=interval or None)
+                except queue.Empty:
+                    acks = []
+                if acks is None:
+                    break
+                # receivers may coalesce several acks into a list
+                if type(acks) is not list:
+                    acks = (acks,)
+                for ack in acks:
+                    self._handle_ack(ack)
+                if interval and time.monotonic() >= next_check:
+                    self._check_receivers()
+                    next_check = time.monotonic() + interval
             except Exception as e:
                 if not self.is_closed:
                     print(f"SharedMemorySender._handle_acks error: {e}")
                     self._cleanup()
                 raise e
 
+    def _send(self, info: SMInfo, block: bool, timeout: float):
+        if self.receivers is None:
+            self.q_data_out.put(info, block, timeout)
+            return
+        # numbered in the order they enter the channel, see _check_receivers
+        with self.send_lock:
+            if info.smh_name is not None:
+                self.sequences[info.key] = self.sent
+            try:
+                self.q_data_out.put(info, block, timeout)
+            except BaseException:
+                self.sequences.pop(info.key, None)
+                raise
+            self.sent += 1
+
+    def _has_room(self) -> bool:
+        # a hint only, checked before writing a message which can't be sent anyway
+        return not self.q_data_out.full()
+
+    def _enqueue(self, info: SMInfo, block: bool, timeout: float):
+        # hands off the descriptor of a registered segment
+        if not self.metrics:
+            self._send(info, block, timeout)
+            return
+        start = time.perf_counter_ns()
+        handle = self.open_handles.get(info.key)
+        if handle is not None:
+            # set before sending, the ack may arrive before _send returns
+            self.open_handles[info.key] = handle._replace(sent_at=start)
+        try:
+            self._send(info, block, timeout)
+        except mp.queues.Full:
+            if handle is not None:
+                self.open_handles[info.key] = handle
+            raise
+        self.metrics.record("enqueue", start, info.message_id)
+
+    def stats(self) -> dict:
+        stats = self.metrics.snapshot() if self.metrics else {}
+        handles = list((self.open_handles or {}).values())
+        stats["outstanding_segments"] = len(handles)
+        stats["outstanding_bytes"] = sum(handle.block.size for handle in handles)
+        return stats
+
     def put_nowait(self, data):
         return self.put(data, block=False)
 
     def put(self, data, block: bool = True, timeout: float = None):
+        self._put(data, 0, block, timeout)
+
+    def put_many(self, items, block: bool = True, timeout: float = None):
+        # the whole batch shares one segment, one descriptor and one ack
+        items = list(items)
+        if not items:
+            return
+        self._put(items, len(items), block, timeout)
+
+    def put_async(self, data, timeout: float = None, immutable: bool = False) -> Future:
+        # returns once the put is queued, put_depth puts in flight apply
+        # backpressure here. the future raises what put would have raised,
+        # including mp.queues.Full once timeout passed. data is serialized and
+        # copied right away unless it is immutable until the future is done
+        return self._put_async(data, 0, timeout, immutable)
+
+    def put_many_async(
+        self, items, timeout: float = None, immutable: bool = False
+    ) -> Future:
+        items = list(items)
+        if not items:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self._put_async(items, len(items), timeout, immutable)
+
+    def _put_async(self, data, batch: int, timeout: float, immutable: bool) -> Future:
         if self.is_closed:
             raise BrokenPipeError("Sender is closed.")
         self._initialize()
+        if self.pipeline is None:
+            self.pipeline = PutPipeline(self, self.put_workers, self.put_depth)
+        return self.pipeline.submit(data, batch, timeout, immutable)
 
-        if self.capacity:
-            if not self.has_capacity.acquire(blocking=block, timeout=timeout):
+    def _acquire_capacity(self, slots: int, block: bool, deadline: float):
+        for acquired in range(slots):
+            timeout = _remaining(deadline) if block else None
+            if not self.has_capacity.acquire(block, timeout):
+                self._release_capacity(acquired)
                 raise mp.queues.Full
 
+    def _release_capacity(self, slots: int):
+        # process shared semaphores can only be released one at a time
+        for _ in range(slots):
+            self.has_capacity.release()
+
+    def _write(
+        self,
+        payload: Payload,
+        batch: int,
+        slots: int,
+        block: bool,
+        deadline: float,
+        message_id: str = None,
+        chunk: bool = False,
+    ) -> SMInfo:
+        metrics = self.metrics
+        if metrics:
+            start = time.perf_counter_ns()
+        # charged by the memory the allocator takes for it, not the payload size
+        nbytes = self.allocator.block_size(payload.total_bytes) if self.budget else 0
+        timeout = _remaining(deadline) if block else None
+        if chunk and not self.window.acquire(block, timeout):
+            raise mp.queues.Full
+
+        try:
+            if self.capacity:
+                self._acquire_capacity(slots, block, deadline)
+        except mp.queues.Full:
+            self._release(0, 0, chunk)
+            raise
+
+        try:
+            if nbytes:
+                self.budget.acquire(nbytes, block, deadline)
+        except (mp.queues.Full, ValueError):
+            self._release(slots, 0, chunk)
+            raise
+        if metrics:
+            start = metrics.record("wait", start, message_id)
+
+        try:
+            handle = self.allocator.allocate(
+                payload.total_bytes, block, _remaining(deadline)
+            )
+        except (mp.queues.Full, ValueError):
+            # out of space or the message can never fit, the sender stays usable
+            self._release(slots, nbytes, chunk)
+            raise
+
+        if metrics:
+            start = metrics.record("allocate", start, message_id)
+        info = payload_to_smh(payload, handle, batch)
+        if metrics:
+            metrics.record("copy", start, message_id)
+        if self.producer is not None or message_id is not None:
+            info = info._replace(producer=self.producer, message_id=message_id)
+        unlinked = self.allocator.unlinked
+        if unlinked:
+            # appended to by the ack thread meanwhile, taken one by one
+            count = min(len(unlinked), MAX_UNLINKED_NAMES)
+            names = tuple(unlinked.popleft() for _ in range(count))
+            info = info._replace(unlinked=names)
+        self.is_empty.clear()
+        # register before sending, the ack may arrive before put returns
+        self.open_handles[info.key] = _OpenHandle(
+            handle, slots, nbytes, message_id=message_id, chunk=chunk
+        )
+        return info
+
+    def _rollback(self, info: SMInfo):
+        # message written but never sent, the names it carried go with a later one
+        self._close_handle(info.key, notify=False)
+        if info.unlinked:
+            self.allocator.unlinked.extendleft(reversed(info.unlinked))
+
+    def _release(self, slots: int, nbytes: int, chunk: bool = False):
+        if self.capacity:
+            self._release_capacity(slots)
+        if nbytes:
+            self.budget.release(nbytes)
+        if chunk:
+            self.window.release()
+
+    def _put(
+        self, data, batch: int, block: bool, timeout: float, payload: Payload = None
+    ):
+        if self.is_closed:
+            raise BrokenPipeError("Sender is closed.")
+        self._initialize()
+
+        slots = batch if batch and self.batch_capacity == "item" else 1
+        if self.capacity and slots > self.capacity:
+            raise ValueError(
+                f"Batch of {batch} items exceeds capacity of {self.capacity}."
+            )
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        metrics = self.metrics
         try:
-            smh, info = data_to_smh(data)
-            self.is_empty.clear()
-            self.q_data_out.put_nowait(info)
-            self.open_handles[smh.name] = smh
+            if metrics:
+                put_start = start = time.perf_counter_ns()
+                message_id = metrics.next_message_id()
+            else:
+                message_id = None
+            if payload is None:
+                payload = serialize(data)
+                if metrics:
+                    metrics.record("serialize", start, message_id)
+            if metrics:
+                metrics.add("messages")
+                metrics.add("items", batch or 1)
+                metrics.add("bytes", payload.total_bytes)
+
+            if payload.total_bytes < self.inline_threshold:
+                # small enough to travel with the descriptor, no segment and no ack
+                info = payload_to_inline(payload, batch)
+                if metrics:
+                    info = info._replace(message_id=message_id)
+                    metrics.add("inline_messages")
+                    start = time.perf_counter_ns()
+                self._send(info, block, _remaining(deadline))
+                if metrics:
+                    metrics.record("enqueue", start, message_id)
+                    metrics.record("put", put_start, message_id)
+                return
+
+            if self.chunk_size and payload.total_bytes > self.chunk_size:
+                self._stream(
+                    payload.chunks,
+                    payload.buffer_lengths,
+                    payload.codec,
+                    batch,
+                    slots,
+                    block,
+                    deadline,
+                    message_id,
+                )
+                if metrics:
+                    metrics.record("put", put_start, message_id)
+                return
+
+            info = self._write(payload, batch, slots, block, deadline, message_id)
+            try:
+                self._enqueue(info, block, _remaining(deadline))
+            except BaseException:
+                # e.g. a bounded channel is full, give the segment and capacity back
+                self._rollback(info)
+                raise
+            if metrics:
+                metrics.record("put", put_start, message_id)
+        except (mp.queues.Full, ValueError):
+            raise
         except Exception as e:
             if not self.is_closed:
                 print(f"SharedMemorySender.put error: {e}")
                 self._cleanup()
             raise e
 
+    def put_stream(self, buffers, block: bool = True, timeout: float = None):
+        # sends bytes-like objects as one message of raw bytes, without
+        # serializing it, get returns their concatenation and get_stream the chunks
+        if self.is_closed:
+            raise BrokenPipeError("Sender is closed.")
+        self._initialize()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        metrics = self.metrics
+        message_id = metrics.next_message_id() if metrics else None
+        if metrics:
+            start = time.perf_counter_ns()
+            metrics.add("messages")
+            metrics.add("items")
+        try:
+            self._stream(buffers, None, CODEC_RAW, 0, 1, block, deadline, message_id)
+        except (mp.queues.Full, ValueError):
+            raise
+        except Exception as e:
+            if not self.is_closed:
+                print(f"SharedMemorySender.put_stream error: {e}")
+                self._cleanup()
+            raise e
+        if metrics:
+            metrics.record("put", start, message_id)
+
+    def _stream(
+        self,
+        buffers,
+        buffer_lengths: list[int],
+        codec_id: int,
+        batch: int,
+        slots: int,
+        block: bool,
+        deadline: float,
+        message_id: str,
+    ):
+        # chunks travel through at most stream_window segments, the receiver copies
+        # the first ones while later ones are written. block and timeout only
+        # apply until the first chunk is sent, the rest waits for the receiver
+        if self.capacity:
+            self._acquire_capacity(slots, block, deadline)
+        held_slots = slots
+        try:
+            chunks = split_chunks(buffers, self.chunk_size or DEFAULT_CHUNK_SIZE)
+            pieces, nbytes = next(chunks)
+            for index in itertools.count():
+                following = next(chunks, None)
+                is_last = following is None
+                payload = Payload(pieces, nbytes, buffer_lengths, codec_id)
+                if nbytes:
+                    info = self._write(
+                        payload, batch, 0, block, deadline, message_id, chunk=True
+                    )
+                else:
+                    # empty stream, nothing to map
+                    info = payload_to_inline(payload, batch)._replace(
+                        inline=None, producer=self.producer, message_id=message_id
+                    )
+                info = info._replace(chunk=(index, is_last))
+                if self.metrics:
+                    self.metrics.add("chunks")
+                    if codec_id == CODEC_RAW:
+                        # counted up front for serialized payloads
+                        self.metrics.add("bytes", nbytes)
+                handle = self.open_handles.get(info.key) if nbytes else None
+                if is_last and handle is not None:
+                    # capacity of the message is given back with the last chunk
+                    self.open_handles[info.key] = handle._replace(slots=slots)
+                    held_slots = 0
+                try:
+                    self._enqueue(info, block, _remaining(deadline))
+                except BaseException:
+                    if handle is not None:
+                        self._rollback(info)
+                    raise
+                if is_last:
+                    return
+                # the first chunk is sent, the remaining ones have to follow
+                block, deadline, buffer_lengths = True, None, None
+                pieces, nbytes = following
+        finally:
+            if held_slots and self.capacity:
+                self._release_capacity(held_slots)
+
+    def reserve(
+        self, nbytes: int, block: bool = True, timeout: float = None
+    ) -> "SharedMemoryReservation":
+        # writable region of shared memory, published to the receiver by commit
+        return self._reserve(
+            nbytes, _memoryview_from_buffer, ("B", (nbytes,)), block, timeout
+        )
+
+    def reserve_array(
+        self, shape, dtype, block: bool = True, timeout: float = None
+    ) -> "SharedMemoryReservation":
+        import numpy as np
+
+        dtype = np.dtype(dtype)
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        nbytes = math.prod(shape) * dtype.itemsize
+        reservation = self._reserve(
+            nbytes, _ndarray_from_buffer, (dtype, shape), block, timeout
+        )
+        reservation.data = np.frombuffer(reservation.data, dtype).reshape(shape)
+        return reservation
+
+    def _reserve(
+        self, nbytes: int, reconstructor, args: tuple, block: bool, timeout: float
+    ) -> "SharedMemoryReservation":
+        if self.is_closed:
+            raise BrokenPipeError("Sender is closed.")
+        self._initialize()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        payload = reserve_payload(nbytes, reconstructor, args)
+        message_id = self.metrics.next_message_id() if self.metrics else None
+        info = self._write(payload, 0, 1, block, deadline, message_id)
+        shm = self.open_handles[info.key].block.shm
+        start = info.offset + payload.total_bytes - nbytes
+        return SharedMemoryReservation(self, info, shm.buf[start : start + nbytes])
+
     def wait_for_all_ack(self):
         if self.is_closed:
             raise BrokenPipeError("Sender is closed.")
         if not self.is_initialized:
             return
+        if self.pipeline is not None:
+            self.pipeline.drain()
         self.is_empty.wait()
@@ -0,0 +1,67 @@
+import json
+import os
+
+# spans are taken with perf_counter_ns, a system wide monotonic clock on Linux,
+# Windows and macOS, so the timelines of processes on one host line up
+
+
+def trace_events(endpoint, label: str = None) -> list[dict]:
+    # chrome trace events of the spans a traced sender or receiver recorded
+    metrics = endpoint.metrics
+    if metrics is None or metrics.spans is None:
+        return []
+
+    label = label or type(endpoint).__name__
+    pid = os.getpid()
+    events = []
+    for stage, start_ns, end_ns, message_id, tid in list(metrics.spans):
+        ts, dur = start_ns / 1000, (end_ns - start_ns) / 1000
+        events.append(
+            {
+                "name": stage,
+                "cat": label,
+                "ph": "X",
+                "ts": ts,
+                "dur": dur,
+                "pid": pid,
+                "tid": tid,
+                "args": {"message_id": message_id},
+            }
+        )
+        if message_id is None or stage not in ("enqueue", "dequeue"):
+            continue
+        # arrow from the handoff in the sender to the dequeue in the receiver
+        events.append(
+            {
+                "name": "message",
+                "cat": "message",
+                "ph": "s" if stage == "enqueue" else "f",
+                "bp": "e",
+                "id": message_id,
+                "ts": ts + dur / 2,
+                "pid": pid,
+                "tid": tid,
+            }
+        )
+    return events
+
+
+def write_trace(path: str, *endpoints, labels: list[str] = None):
+    # one file per process, combine them with merge_traces
+    labels = labels or [None] * len(endpoints)
+    events = []
+    for endpoint, label in zip(endpoints, labels):
+        events.extend(trace_events(endpoint, label))
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events}, f)
+
+
+def merge_traces(paths: list[str], output: str):
+    # loads in chrome://tracing or https://ui.perfetto.dev
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events.extend(json.load(f)["traceEvents"])
+    events.sort(key=lambda event: event["ts"])
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events}, f)
@@ -0,0 +1,309 @@
+import multiprocessing as mp
+import threading as th
+import argparse
+import itertools
+import platform
+import shutil
+import json
+import time
+import sys
+import os
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from memory import create_shared_memory_pair, create_multi_producer_pair
+from memory.convert import serialize
+
+PAYLOADS = ["bytes", "ndarray", "dict", "objects"]
+TRANSPORTS = ["smq", "queue"]
+SIZES = [
+    1_000,  # 1KB
+    100_000,  # 100KB
+    10_000_000,  # 10MB
+]
+# each case sends at most this many messages and bytes
+MAX_MESSAGES = 2_000
+MAX_BYTES = 4_000_000_000
+SHM_DIR = "/dev/shm"
+SHM_SAMPLE_INTERVAL = 0.005
+
+
+def make_payload(kind: str, size: int):
+    if kind == "bytes":
+        return os.urandom(size)
+    if kind == "ndarray":
+        return np.random.rand(max(1, size // 8))
+    if kind == "dict":
+        # nested dicts of arrays with a bit of metadata
+        return {
+            "meta": {"id": 1, "name": "frame", "scale": 0.5},
+            "images": {
+                "rgb": np.random.rand(max(1, size // 16)),
+                "depth": np.random.rand(max(1, size // 32)),
+            },
+            "mask": np.zeros(max(1, size // 32), dtype=np.float64),
+        }
+    if kind == "objects":
+        # many small python objects, the worst case for out-of-band buffers
+        return [
+            {"id": i, "value": i * 0.5, "name": f"item{i:08d}"}
+            for i in range(max(1, size // 64))
+        ]
+    raise ValueError(f"Unknown payload {kind}")
+
+
+def _usage() -> dict:
+    usage = {"cpu_s": time.process_time(), "peak_rss_bytes": None}
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        usage["peak_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return usage
+
+
+def producer(transport, sender, kind, size, count, ready, go, results):
+    payload = make_payload(kind, size)
+    ready.release()
+    go.wait()
+    for _ in range(count):
+        sender.put((time.perf_counter_ns(), payload))
+    if transport == "smq":
+        sender.wait_for_all_ack()
+    results.put(("producer", _usage()))
+
+
+def consumer(receiver, count, ready, go, results):
+    latencies = np.empty(count, dtype=np.int64)
+    ready.release()
+    go.wait()
+    for i in range(count):
+        sent_at, _ = receiver.get()
+        latencies[i] = time.perf_counter_ns() - sent_at
+    usage = _usage()
+    usage["done_at"] = time.perf_counter_ns()
+    usage["latencies"] = latencies
+    results.put(("consumer", usage))
+
+
+def _sample_shm(samples: list, stop: th.Event):
+    while not stop.is_set():
+        samples.append(shutil.disk_usage(SHM_DIR).used)
+        stop.wait(SHM_SAMPLE_INTERVAL)
+
+
+def run_case(transport, kind, size, capacity, producers, consumers, start_method):
+    # the package creates its queues and semaphores in the default context
+    mp.set_start_method(start_method, force=True)
+    ctx = mp.get_context(start_method)
+    if transport == "smq":
+        if producers == 1:
+            sender, receiver = create_shared_memory_pair(capacity)
+            senders = [sender]
+        else:
+            senders, receiver = create_multi_producer_pair(producers, capacity)
+    else:
+        queue = ctx.Queue(capacity or 0)
+        senders, receiver = [queue] * producers, queue
+
+    count = max(1, min(MAX_MESSAGES, MAX_BYTES // size)) // producers
+    total = count * producers
+    shares = [total // consumers + (i < total % consumers) for i in range(consumers)]
+
+    ready, go, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=producer,
+            args=(transport, sender, kind, size, count, ready, go, results),
+        )
+        for sender in senders
+    ] + [
+        ctx.Process(target=consumer, args=(receiver, share, ready, go, results))
+        for share in shares
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.acquire()
+
+    shm_samples, stop = [], th.Event()
+    sampler = None
+    if os.path.isdir(SHM_DIR):
+        shm_samples.append(shutil.disk_usage(SHM_DIR).used)
+        sampler = th.Thread(target=_sample_shm, args=(shm_samples, stop), daemon=True)
+        sampler.start()
+
+    started_at = time.perf_counter_ns()
+    go.set()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    stop.set()
+    if sampler is not None:
+        sampler.join()
+
+    producer_reports = [usage for role, usage in reports if role == "producer"]
+    consumer_reports = [usage for role, usage in reports if role == "consumer"]
+    latencies = np.concatenate([usage["latencies"] for usage in consumer_reports])
+    duration = (max(usage["done_at"] for usage in consumer_reports) - started_at) / 1e9
+    message_bytes = serialize(make_payload(kind, size)).total_bytes
+
+    def _peak_rss(usages):
+        values = [usage["peak_rss_bytes"] for usage in usages]
+        return None if None in values else max(values)
+
+    return {
+        "transport": transport,
+        "payload": kind,
+        "size": size,
+        "capacity": capacity,
+        "producers": producers,
+        "consumers": consumers,
+        "start_method": start_method,
+        "messages": total,
+        "message_bytes": message_bytes,
+        "duration_s": duration,
+        "throughput_bytes_s": total * message_bytes / duration,
+        "throughput_messages_s": total / duration,
+        "latency_s": {
+            "mean": float(np.mean(latencies)) / 1e9,
+            "p50": float(np.percentile(latencies, 50)) / 1e9,
+            "p99": float(np.percentile(latencies, 99)) / 1e9,
+            "p999": float(np.percentile(latencies, 99.9)) / 1e9,
+            "max": float(np.max(latencies)) / 1e9,
+        },
+        "cpu_s": {
+            "producers": sum(usage["cpu_s"] for usage in producer_reports),
+            "consumers": sum(usage["cpu_s"] for usage in consumer_reports),
+        },
+        "peak_rss_bytes": {
+            "producers": _peak_rss(producer_reports),
+            "consumers": _peak_rss(consumer_reports),
+        },
+        "peak_shm_bytes": (max(shm_samples) - shm_samples[0] if shm_samples else None),
+    }
+
+
+def _case_key(result: dict) -> tuple:
+    return tuple(
+        result[key]
+        for key in (
+            "transport",
+            "payload",
+            "size",
+            "capacity",
+            "producers",
+            "consumers",
+            "start_method",
+        )
+    )
+
+
+def _version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("py-sharedmemory")
+    except Exception:
+        return None
+
+
+def run(args):
+    cases = list(
+        itertools.product(
+            args.transports,
+            args.payloads,
+            args.sizes,
+            args.capacities,
+            args.producers,
+            args.consumers,
+            args.start_methods,
+        )
+    )
+    results = []
+    for i, case in enumerate(cases):
+        print(f"[{i + 1}/{len(cases)}] " + " ".join(map(str, case)), flush=True)
+        result = run_case(*case)
+        print(
+            f"    {result['throughput_messages_s']:.0f} msg/s, "
+            f"{result['throughput_bytes_s'] / 1e6:.1f} MB/s, "
+            f"p50 {result['latency_s']['p50'] * 1e6:.0f}us, "
+            f"p99 {result['latency_s']['p99'] * 1e6:.0f}us",
+            flush=True,
+        )
+        results.append(result)
+
+    report = {
+        "meta": {
+            "version": _version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def compare(args) -> int:
+    # exit code 1 if a case lost more than threshold of throughput or p99 latency
+    with open(args.baseline) as f:
+        baseline = {_case_key(r): r for r in json.load(f)["results"]}
+    with open(args.candidate) as f:
+        candidate = {_case_key(r): r for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'case':<60} {'throughput':>12} {'p99':>12}")
+    for key, new in candidate.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        throughput = new["throughput_bytes_s"] / old["throughput_bytes_s"] - 1
+        p99 = new["latency_s"]["p99"] / old["latency_s"]["p99"] - 1
+        regressed = throughput < -args.threshold or p99 > args.threshold
+        regressions += regressed
+        name = " ".join(map(str, key))
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<60} {throughput:>+11.1%} {p99:>+11.1%}{flag}")
+
+    missing = len(baseline.keys() - candidate.keys())
+    if missing:
+        print(f"{missing} baseline cases missing in candidate")
+    print(f"{regressions} regressions beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="py-sharedmemory benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="run the benchmark matrix")
+    parser_run.add_argument("--output", default="benchmark.json")
+    parser_run.add_argument("--transports", nargs="+", default=TRANSPORTS)
+    parser_run.add_argument("--payloads", nargs="+", default=PAYLOADS)
+    parser_run.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser_run.add_argument("--capacities", nargs="+", type=int, default=[8])
+    parser_run.add_argument("--producers", nargs="+", type=int, default=[1])
+    parser_run.add_argument("--consumers", nargs="+", type=int, default=[1])
+    parser_run.add_argument("--start-methods", nargs="+", default=["spawn"])
+
+    parser_compare = commands.add_parser("compare", help="compare two result files")
+    parser_compare.add_argument("baseline")
+    parser_compare.add_argument("candidate")
+    parser_compare.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +0,0 @@
-from memory import create_shared_memory_pair
-
-from performance_test_base import PerformanceTest
-
-
-if __name__ == "__main__":
-
-    def factory():
-        sender, receiver = create_shared_memory_pair(None)
-        return sender.put, receiver.get
-
-    test = PerformanceTest("smq_e2e", factory)
-    test.run_for_time(30)
-
-    print("Test completed successfully.")
@@ -1,13 +1,27 @@
 import unittest
 import numpy as np
 import time
+import array
+import asyncio
 import multiprocessing as mp
+import os
+import threading as th
+import sys
+import gc
 
 mp.log_to_stderr()
 
 from typing import NamedTuple
 
-from memory import create_shared_memory_pair
+from memory import (
+    create_shared_memory_pair,
+    create_broadcast_group,
+    create_multi_producer_pair,
+    AsyncSharedMemorySender,
+    AsyncSharedMemoryReceiver,
+)
+from memory.factory import calibrate_inline_threshold
+from memory.channel import SharedMemoryChannel
 
 
 class MyTuple(NamedTuple):
@@ -20,11 +34,31 @@ def _send(sender, data):
     sender.put(data)
     time.sleep(1)
 
+
+def _send_many(sender, items):
+    for item in items:
+        sender.put(item)
+    sender.wait_for_all_ack()
+
+
+def _take_and_die(receiver):
+    # exits holding the message, its ack is never sent
+    lease = receiver.get(timeout=2, zero_copy=True)
+    os._exit(0)
+
+
 def _receive(receiver, target):
     item = receiver.get(timeout=2)
     assert item == target, f"Expected {target}, got {item}"
 
 
+def _receive_many(receiver, count):
+    # returns right after the last get, pending acks go out at exit
+    for expected in range(count):
+        item = receiver.get(timeout=5)
+        assert item == expected, f"Expected {expected}, got {item}"
+
+
 class TestSharedMemory(unittest.TestCase):
 
     def test_process_send(self):
@@ -94,6 +128,1339 @@ class TestSharedMemory(unittest.TestCase):
         with self.assertRaises(mp.queues.Empty):
             receiver.get(block=False)
 
+    # TESTING SEGMENT POOL
+
+    def test_pool_reuses_segment(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, pool_max_bytes=1_000_000
+        )
+        sender.put(b"a" * 1000)
+        name, _ = next(iter(sender.open_handles))
+        self.assertEqual(receiver.get(timeout=2), b"a" * 1000)
+        sender.wait_for_all_ack()
+        self.assertGreater(sender.allocator.pooled_bytes, 0)
+
+        sender.put(b"b" * 1000)
+        self.assertEqual(next(iter(sender.open_handles)), (name, 0))
+        info = receiver.q_data_in.get(timeout=2)
+        self.assertEqual(info.smh_name, name)
+        self.assertEqual(info.generation, 1)
+
+    def test_pool_max_bytes(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, pool_max_bytes=1)
+        sender.put(42)
+        self.assertEqual(receiver.get(timeout=2), 42)
+        sender.wait_for_all_ack()
+        self.assertEqual(sender.allocator.pooled_bytes, 0)
+
+    def test_pool_idle_eviction(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, pool_max_bytes=1_000_000, pool_idle_timeout=0.0
+        )
+        sender.put(b"a" * 1000)
+        name = next(iter(sender.open_handles))
+        receiver.get(timeout=2)
+        sender.wait_for_all_ack()
+        time.sleep(0.01)
+        sender.put(b"a" * 1000)
+        self.assertNotEqual(next(iter(sender.open_handles)), name)
+        receiver.get(timeout=2)
+
+    def test_pool_idle_eviction_without_puts(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, pool_max_bytes=1_000_000, pool_idle_timeout=0.1
+        )
+        sender.put(b"a" * 1000)
+        receiver.get(timeout=2)
+        sender.wait_for_all_ack()
+        self.assertGreater(sender.allocator.pooled_bytes, 0)
+        # evicted by the timer while the sender is idle
+        time.sleep(0.3)
+        self.assertEqual(sender.allocator.pooled_bytes, 0)
+        self.assertEqual(sender.allocator.segments, {})
+
+    # TESTING ARENA
+
+    def test_arena_offsets(self):
+        sender, receiver = create_shared_memory_pair(capacity=3, arena_size=1_000_000)
+        sender.put(b"a" * 1000)
+        sender.put(b"b" * 1000)
+        infos = [receiver.q_data_in.get(timeout=2) for _ in range(2)]
+        self.assertEqual(infos[0].smh_name, infos[1].smh_name)
+        self.assertNotEqual(infos[0].offset, infos[1].offset)
+        self.assertEqual(receiver._process_info(infos[0]), b"a" * 1000)
+        self.assertEqual(receiver._process_info(infos[1]), b"b" * 1000)
+        sender.wait_for_all_ack()
+        self.assertEqual(sender.allocator.free_bytes, sender.allocator.size)
+
+    def test_arena_full(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, arena_size=4096)
+        sender.put(b"a" * 3000)
+        with self.assertRaises(mp.queues.Full):
+            sender.put(b"b" * 3000, timeout=0.1)
+        self.assertEqual(receiver.get(timeout=2), b"a" * 3000)
+        sender.put(b"b" * 3000, timeout=2)
+        self.assertEqual(receiver.get(timeout=2), b"b" * 3000)
+
+    def test_arena_coalesce(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, arena_size=3072)
+        for i in range(3):
+            sender.put(bytes([i]) * 900)
+        for i in range(3):
+            self.assertEqual(receiver.get(timeout=2), bytes([i]) * 900)
+        sender.wait_for_all_ack()
+        sender.put(b"c" * 3000)
+        self.assertEqual(receiver.get(timeout=2), b"c" * 3000)
+
+    # TESTING ZERO COPY
+
+    def test_zero_copy_ndarray(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = np.random.rand(100, 100)
+        sender.put(data)
+        lease = receiver.get(timeout=2, zero_copy=True)
+        np.testing.assert_array_equal(lease.data, data)
+        self.assertFalse(lease.data.flags.owndata)
+        time.sleep(0.2)
+        self.assertEqual(len(sender.open_handles), 1)
+        lease.release()
+        self.assertTrue(lease.released)
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_zero_copy_context_manager(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        sender.put([1, 2, 3])
+        with receiver.get(timeout=2, zero_copy=True) as item:
+            self.assertEqual(item, [1, 2, 3])
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_zero_copy_release_on_gc(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        sender.put(42)
+        lease = receiver.get(timeout=2, zero_copy=True)
+        self.assertEqual(lease.data, 42)
+        del lease
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_zero_copy_aligned_buffers(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        arrays = [np.arange(5, dtype=np.int8), np.random.rand(10, 10)]
+        # the array codec and pickle
+        for data in (tuple(arrays), ["abc", *arrays]):
+            sender.put(data)
+            with receiver.get(timeout=2, zero_copy=True) as item:
+                for array_in, array_out in zip(arrays, item[-2:]):
+                    np.testing.assert_array_equal(array_in, array_out)
+                    self.assertTrue(array_out.flags.aligned)
+                    self.assertEqual(array_out.ctypes.data % 64, 0)
+
+    def test_zero_copy_data_outlives_lease(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = [np.random.rand(100, 100), {"b": "text"}]
+        sender.put(data)
+        unraisable = []
+        hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+        try:
+            item = receiver.get(timeout=2, zero_copy=True).data
+            gc.collect()
+            sender.wait_for_all_ack()
+            # the segment is unlinked, the array still maps it
+            np.testing.assert_array_equal(item[0], data[0])
+            del item
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+        self.assertEqual(unraisable, [])
+
+    # TESTING OUT-OF-BAND BUFFERS
+
+    def test_out_of_band_bytes(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = {"a": [b"x" * 100_000, (b"y" * 100_000, 1)], "b": b"small"}
+        sender.put(data)
+        info = receiver.q_data_in.get(timeout=2)
+        self.assertEqual(len(info.buffer_lengths), 3)
+        item = receiver._process_info(info)
+        self.assertEqual(item, data)
+        self.assertIs(type(item["a"][0]), bytes)
+
+    def test_out_of_band_bytearray(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = bytearray(b"x" * 100_000)
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(item, data)
+        self.assertIs(type(item), bytearray)
+
+    def test_out_of_band_array(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = array.array("d", range(100_000))
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(item, data)
+
+    def test_out_of_band_memoryview(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = memoryview(array.array("i", range(12))).cast("B").cast("i", (3, 4))
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(item.shape, (3, 4))
+        self.assertEqual(item.tolist(), data.tolist())
+
+    def test_out_of_band_zero_copy(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = [b"x" * 100_000]
+        sender.put(data)
+        with receiver.get(timeout=2, zero_copy=True) as item:
+            self.assertEqual(item, data)
+
+    def test_out_of_band_shared_references(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        buffer = b"x" * 100_000
+        inner = [buffer]
+        sender.put([buffer, buffer, inner, inner])
+        info = receiver.q_data_in.get(timeout=2)
+        # sent once, like plain pickle does
+        self.assertEqual(len(info.buffer_lengths), 2)
+        item = receiver._process_info(info)
+        self.assertIs(item[0], item[1])
+        self.assertIs(item[2], item[3])
+        self.assertIs(item[2][0], item[0])
+
+    def test_out_of_band_cycle(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = [1, b"x" * 100_000]
+        data.append(data)
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertIs(item[2], item)
+        self.assertEqual(item[1], data[1])
+
+    # TESTING INLINE MESSAGES
+
+    def test_inline_small(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, inline_threshold=1000)
+        sender.put(42)
+        self.assertEqual(len(sender.open_handles), 0)
+        info = receiver.q_data_in.get(timeout=2)
+        self.assertIsNone(info.smh_name)
+        self.assertEqual(receiver._process_info(info), 42)
+
+    def test_inline_order(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=None, inline_threshold=1000
+        )
+        data = [1, b"x" * 10_000, "a", np.arange(1000), None]
+        for item in data:
+            sender.put(item)
+        self.assertEqual(len(sender.open_handles), 2)
+        for expected in data:
+            item = receiver.get(timeout=2)
+            np.testing.assert_array_equal(item, expected)
+
+    def test_inline_bypasses_capacity(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, inline_threshold=1000)
+        sender.put(b"x" * 10_000)
+        sender.put_nowait(42)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(b"y" * 10_000)
+        self.assertEqual(receiver.get(timeout=2), b"x" * 10_000)
+        self.assertEqual(receiver.get(timeout=2), 42)
+
+    def test_inline_capacity(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, inline_threshold=1000, inline_capacity=2, stream_window=1
+        )
+        # room for one segment, one stream chunk and two more inline messages
+        for item in range(4):
+            sender.put_nowait(item)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(4)
+        with self.assertRaises(mp.queues.Full):
+            sender.put(4, timeout=0.1)
+        self.assertEqual(receiver.get(timeout=2), 0)
+        sender.put_nowait(4)
+        for expected in range(1, 5):
+            self.assertEqual(receiver.get(timeout=2), expected)
+
+    def test_inline_zero_copy(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, inline_threshold=1000)
+        sender.put(42)
+        with receiver.get(timeout=2, zero_copy=True) as item:
+            self.assertEqual(item, 42)
+
+    def test_inline_calibrate(self):
+        threshold = calibrate_inline_threshold(max_bytes=100_000, repeats=1)
+        self.assertGreater(threshold, 0)
+        self.assertLessEqual(threshold, 100_000)
+
+    # TESTING SHARED MEMORY CHANNEL
+
+    def test_channel_process_send(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, channel_slots=8)
+        data = 42
+        process = mp.Process(target=_send, args=(sender, data))
+        process.start()
+        item = receiver.get(timeout=2)
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(item, data)
+
+    def test_channel_multiple_send(self):
+        N = 100
+        sender, receiver = create_shared_memory_pair(
+            capacity=N, channel_slots=16, inline_threshold=100
+        )
+        for i in range(N):
+            sender.put(i if i % 2 else b"x" * i)
+            self.assertEqual(receiver.get(timeout=2), i if i % 2 else b"x" * i)
+
+    def test_channel_full(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, channel_slots=2)
+        sender.put(1)
+        sender.put(2)
+        with self.assertRaises(mp.queues.Full):
+            sender.put(3, timeout=0.1)
+        self.assertEqual(len(sender.open_handles), 2)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        self.assertEqual(receiver.get(timeout=2), 2)
+        with self.assertRaises(mp.queues.Empty):
+            receiver.get(timeout=0.1)
+
+    def test_channel_slot_size(self):
+        channel = SharedMemoryChannel(slots=2, slot_size=64)
+        # spilled to a segment of its own
+        channel.put(b"x" * 100)
+        channel.put_nowait("a")
+        self.assertEqual(channel.get_nowait(), b"x" * 100)
+        self.assertEqual(channel.get_nowait(), "a")
+        channel.close()
+
+    def test_channel_large_descriptor(self):
+        sender, receiver = create_shared_memory_pair(capacity=2, channel_slots=8)
+        # one buffer length per array, far more than fit into a slot
+        data = [np.arange(10) for _ in range(1000)]
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(item, data)))
+
+    def test_channel_ring_size(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, channel_slots=1024, inline_threshold=4_000_000
+        )
+        self.assertEqual(receiver.q_data_in.slot_size, 64 * 1024)
+        # inline messages larger than a slot are spilled
+        sender.put(b"y" * 3_000_000)
+        self.assertEqual(receiver.get(timeout=2), b"y" * 3_000_000)
+
+    # TESTING BATCHES
+
+    def test_put_many(self):
+        sender, receiver = create_shared_memory_pair(capacity=10)
+        data = [np.arange(i) for i in range(8)]
+        sender.put_many(data)
+        self.assertEqual(len(sender.open_handles), 1)
+        for expected in data:
+            np.testing.assert_array_equal(receiver.get(timeout=2), expected)
+        sender.wait_for_all_ack()
+
+    def test_get_many(self):
+        sender, receiver = create_shared_memory_pair(capacity=10)
+        sender.put_many([1, 2, 3])
+        sender.put(4)
+        sender.put_many([5, 6])
+        time.sleep(0.1)
+        self.assertEqual(receiver.get_many(4, timeout=2), [1, 2, 3, 4])
+        self.assertEqual(receiver.get_many(4, timeout=2), [5, 6])
+        with self.assertRaises(mp.queues.Empty):
+            receiver.get_many(4, timeout=0.1)
+
+    def test_put_many_capacity_item(self):
+        sender, receiver = create_shared_memory_pair(capacity=4)
+        sender.put_many([1, 2, 3])
+        with self.assertRaises(mp.queues.Full):
+            sender.put_many([4, 5], block=False)
+        with self.assertRaises(ValueError):
+            sender.put_many([1, 2, 3, 4, 5])
+        sender.put(4, block=False)
+
+    def test_put_many_capacity_batch(self):
+        sender, receiver = create_shared_memory_pair(capacity=2, batch_capacity="batch")
+        sender.put_many([1, 2, 3])
+        sender.put_many([4, 5, 6])
+        with self.assertRaises(mp.queues.Full):
+            sender.put_many([7], block=False)
+        self.assertEqual([receiver.get(timeout=2) for _ in range(3)], [1, 2, 3])
+        sender.put_many([7], timeout=2)
+        time.sleep(0.1)
+        self.assertEqual(receiver.get_many(10, timeout=2), [4, 5, 6, 7])
+
+    # TESTING BROADCAST
+
+    def test_broadcast(self):
+        sender, receivers = create_broadcast_group(3, capacity=2)
+        data = np.arange(1000)
+        sender.put(data)
+        self.assertEqual(len(sender.open_handles), 1)
+        for receiver in receivers[:2]:
+            np.testing.assert_array_equal(receiver.get(timeout=2), data)
+        time.sleep(0.2)
+        self.assertEqual(len(sender.open_handles), 1)
+        np.testing.assert_array_equal(receivers[2].get(timeout=2), data)
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_broadcast_process_receive(self):
+        sender, receivers = create_broadcast_group(2, capacity=1)
+        sender.put(42)
+        processes = [
+            mp.Process(target=_receive, args=(receiver, 42)) for receiver in receivers
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        sender.wait_for_all_ack()
+
+    def test_broadcast_block(self):
+        sender, receivers = create_broadcast_group(2, capacity=1)
+        sender.put(1)
+        self.assertEqual(receivers[0].get(timeout=2), 1)
+        with self.assertRaises(mp.queues.Full):
+            sender.put(2, timeout=0.2)
+
+    def test_broadcast_block_channel_full(self):
+        sender, receivers = create_broadcast_group(2, capacity=None, channel_slots=1)
+        sender.put_nowait(1)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(2)
+        self.assertEqual(sender.dropped, [0, 0])
+        self.assertEqual(len(sender.open_handles), 1)
+        for receiver in receivers:
+            self.assertEqual(receiver.get(timeout=2), 1)
+        sender.put_nowait(2)
+        for receiver in receivers:
+            self.assertEqual(receiver.get(timeout=2), 2)
+        sender.wait_for_all_ack()
+
+    def test_broadcast_drop(self):
+        sender, receivers = create_broadcast_group(2, capacity=1, policy="drop")
+        sender.put(1)
+        self.assertEqual(receivers[0].get(timeout=2), 1)
+        time.sleep(0.2)
+        sender.put(2, timeout=0.2)
+        self.assertEqual(sender.dropped, [0, 1])
+        self.assertEqual(receivers[0].get(timeout=2), 2)
+        self.assertEqual(receivers[1].get(timeout=2), 1)
+        with self.assertRaises(mp.queues.Empty):
+            receivers[1].get(timeout=0.1)
+        sender.wait_for_all_ack()
+
+    # TESTING MULTIPLE PRODUCERS
+
+    def test_multi_producer(self):
+        senders, receiver = create_multi_producer_pair(3, capacity=4)
+        processes = [
+            mp.Process(target=_send_many, args=(sender, [(p, i) for i in range(20)]))
+            for p, sender in enumerate(senders)
+        ]
+        for process in processes:
+            process.start()
+        items = [receiver.get(timeout=5) for _ in range(60)]
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(sorted(items), [(p, i) for p in range(3) for i in range(20)])
+        for p in range(3):
+            self.assertEqual([i for q, i in items if q == p], list(range(20)))
+
+    def test_multi_producer_shared_capacity(self):
+        senders, receiver = create_multi_producer_pair(2, capacity=2)
+        senders[0].put(1)
+        senders[1].put(2)
+        with self.assertRaises(mp.queues.Full):
+            senders[0].put_nowait(3)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        senders[1].put(3, timeout=2)
+        self.assertEqual(len(senders[0].open_handles), 0)
+        self.assertEqual(len(senders[1].open_handles), 2)
+
+    def test_sender_single_owner(self):
+        sender, receiver = create_shared_memory_pair(capacity=2)
+        process = mp.Process(target=_send, args=(sender, 42))
+        process.start()
+        self.assertEqual(receiver.get(timeout=2), 42)
+        with self.assertRaises(RuntimeError):
+            sender.put(43)
+        process.join()
+
+    # TESTING ASYNCIO
+
+    def test_async_put_get(self):
+        sender, receiver = create_shared_memory_pair(capacity=2)
+
+        async def main():
+            a_sender = AsyncSharedMemorySender(sender)
+            a_receiver = AsyncSharedMemoryReceiver(receiver)
+            consumer = asyncio.ensure_future(
+                asyncio.gather(*[a_receiver.get(timeout=5) for _ in range(10)])
+            )
+            for i in range(10):
+                await a_sender.put(np.full(100_000, i))
+            return await consumer
+
+        items = asyncio.run(main())
+        self.assertEqual(sorted(int(item[0]) for item in items), list(range(10)))
+
+    def test_async_backpressure(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+
+        async def main():
+            a_sender = AsyncSharedMemorySender(sender)
+            await a_sender.put(1)
+            with self.assertRaises(mp.queues.Full):
+                await a_sender.put(2, timeout=0.2)
+            put = asyncio.ensure_future(a_sender.put(3, timeout=5))
+            await asyncio.sleep(0.1)
+            # the event loop keeps running while the put waits for capacity
+            self.assertFalse(put.done())
+            self.assertEqual(receiver.get(timeout=2), 1)
+            await put
+
+        asyncio.run(main())
+        self.assertEqual(receiver.get(timeout=2), 3)
+
+    def test_async_stream(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, chunk_size=50_000, stream_window=2
+        )
+
+        async def main():
+            a_sender = AsyncSharedMemorySender(sender)
+            a_receiver = AsyncSharedMemoryReceiver(receiver)
+            consumer = asyncio.ensure_future(a_receiver.get(timeout=5))
+            # more chunks than the window holds, the receiver runs on the same loop
+            await asyncio.wait_for(a_sender.put(b"x" * 500_000), 5)
+            return await consumer
+
+        self.assertEqual(asyncio.run(main()), b"x" * 500_000)
+
+    def test_async_channel_full(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, channel_slots=1)
+        writes = []
+        write = sender._write
+        sender._write = lambda *args, **kwargs: writes.append(1) or write(
+            *args, **kwargs
+        )
+
+        async def main():
+            a_sender = AsyncSharedMemorySender(sender)
+            data = np.zeros(1_000_000)
+            await a_sender.put(data)
+            with self.assertRaises(mp.queues.Full):
+                await a_sender.put(data, timeout=0.3)
+            # the second message was never written while the channel was full
+            self.assertEqual(len(writes), 1)
+            put = asyncio.ensure_future(a_sender.put(data, timeout=5))
+            await asyncio.sleep(0.1)
+            self.assertEqual(len(receiver.get(timeout=2)), len(data))
+            await put
+
+        asyncio.run(main())
+        self.assertEqual(len(receiver.get(timeout=2)), 1_000_000)
+
+    def test_async_get_timeout(self):
+        _, receiver = create_shared_memory_pair(capacity=1)
+        a_receiver = AsyncSharedMemoryReceiver(receiver)
+        with self.assertRaises(mp.queues.Empty):
+            asyncio.run(a_receiver.get(timeout=0.1))
+
+    def test_async_channel(self):
+        sender, receiver = create_shared_memory_pair(capacity=2, channel_slots=8)
+        a_receiver = AsyncSharedMemoryReceiver(receiver)
+        sender.put([1, 2, 3])
+        self.assertEqual(asyncio.run(a_receiver.get(timeout=2)), [1, 2, 3])
+
+    # TESTING RESERVE AND COMMIT
+
+    def test_reserve(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        reservation = sender.reserve(10)
+        reservation.data[:] = b"0123456789"
+        reservation.commit()
+        self.assertEqual(bytes(receiver.get(timeout=2)), b"0123456789")
+
+    def test_reserve_array(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, arena_size=1 << 24)
+        reservation = sender.reserve_array((100, 200), np.float32)
+        self.assertEqual(reservation.data.ctypes.data % 64, 0)
+        reservation.data[:] = np.arange(200, dtype=np.float32)
+        reservation.commit()
+        item = receiver.get(timeout=2)
+        self.assertEqual(item.shape, (100, 200))
+        self.assertEqual(item.dtype, np.float32)
+        self.assertTrue(np.all(item == np.arange(200, dtype=np.float32)))
+
+    def test_reserve_capacity(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        reservation = sender.reserve(100)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(1)
+        reservation.abort()
+        sender.put(2, timeout=2)
+        self.assertEqual(receiver.get(timeout=2), 2)
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_reserve_context(self):
+        sender, receiver = create_shared_memory_pair(capacity=2)
+        with sender.reserve(4) as view:
+            view[:] = b"abcd"
+        with self.assertRaises(ValueError):
+            view[0] = 0
+        with self.assertRaises(KeyError):
+            with sender.reserve(4) as view:
+                raise KeyError
+        self.assertEqual(bytes(receiver.get(timeout=2)), b"abcd")
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_reserve_dropped(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        reservation = sender.reserve_array(100, np.float64)
+        reservation.data[:] = 1
+        del reservation
+        # aborted once collected, its capacity is available again
+        self.assertEqual(len(sender.open_handles), 0)
+        sender.put(1, timeout=2)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        sender.wait_for_all_ack()
+
+    # TESTING ARRAY CODEC
+
+    def test_codec_array(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(item.dtype, data.dtype)
+        self.assertTrue(np.array_equal(item, data))
+
+    def test_codec_dict(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, inline_threshold=1024)
+        data = {
+            "image": np.random.rand(4, 5).astype(np.float32),
+            "mask": np.zeros(3, dtype=bool),
+            "time": np.array(["2024-01-01"], dtype="datetime64[ns]"),
+            "id": 7,
+            "score": 0.5,
+            "valid": True,
+            "name": "frame",
+            "parent": None,
+        }
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(list(item.keys()), list(data.keys()))
+        for key, value in data.items():
+            if isinstance(value, np.ndarray):
+                self.assertEqual(item[key].dtype, value.dtype)
+                self.assertTrue(np.array_equal(item[key], value))
+            else:
+                self.assertEqual(item[key], value)
+
+    def test_codec_tuple_zero_copy(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = (np.ones((2, 2)), np.empty((0, 3)), np.array(5.0), 3)
+        sender.put(data)
+        with receiver.get(timeout=2, zero_copy=True) as item:
+            self.assertEqual(len(item), 4)
+            self.assertTrue(np.array_equal(item[0], data[0]))
+            self.assertEqual(item[1].shape, (0, 3))
+            self.assertEqual(item[2].shape, ())
+            self.assertEqual(item[2], 5.0)
+            self.assertEqual(item[3], 3)
+
+    def test_codec_zero_copy_outlives_lease(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = {"a": np.random.rand(100, 100), "b": np.arange(10)}
+        sender.put(data)
+        item = receiver.get(timeout=2, zero_copy=True).data
+        gc.collect()
+        sender.wait_for_all_ack()
+        # the lease is gone, the arrays still map the segment
+        for key, value in data.items():
+            self.assertTrue(np.array_equal(item[key], value))
+
+    def test_codec_fallback(self):
+        from memory.convert import serialize, CODEC_ARRAYS, CODEC_PICKLE
+
+        self.assertEqual(serialize(np.zeros(4)).codec, CODEC_ARRAYS)
+        for data in [
+            np.zeros((4, 4))[:, 1],
+            np.array([None, 1], dtype=object),
+            {"nested": {"a": np.zeros(1)}},
+            {1: np.zeros(1)},
+            {"k" * 0x10000: np.zeros(1)},
+            (np.zeros(1), 1 << 70),
+            {"a": 1},
+        ]:
+            self.assertEqual(serialize(data).codec, CODEC_PICKLE)
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = np.zeros((4, 4))[:, 1]
+        sender.put(data)
+        self.assertTrue(np.array_equal(receiver.get(timeout=2), data))
+        data = {"k" * 0x10000: np.zeros(1)}
+        sender.put(data)
+        self.assertEqual(list(receiver.get(timeout=2)), list(data))
+
+    # TESTING BYTE BUDGET
+
+    def test_budget(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, max_bytes=3_000_000)
+        sender.put(np.zeros(2_000_000, dtype=np.uint8))
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(np.zeros(2_000_000, dtype=np.uint8))
+        with self.assertRaises(mp.queues.Full):
+            sender.put(np.zeros(2_000_000, dtype=np.uint8), timeout=0.1)
+        sender.put(np.zeros(500_000, dtype=np.uint8))
+        self.assertEqual(len(receiver.get(timeout=2)), 2_000_000)
+        sender.put(np.zeros(2_000_000, dtype=np.uint8), timeout=2)
+        self.assertEqual(len(receiver.get(timeout=2)), 500_000)
+        self.assertEqual(len(receiver.get(timeout=2)), 2_000_000)
+        sender.wait_for_all_ack()
+        self.assertEqual(sender.budget.used.value, 0)
+
+    def test_budget_oversize(self):
+        sender, receiver = create_shared_memory_pair(capacity=None, max_bytes=1_000_000)
+        with self.assertRaises(ValueError):
+            sender.put(np.zeros(2_000_000, dtype=np.uint8))
+        sender.put(1)
+        self.assertEqual(receiver.get(timeout=2), 1)
+
+        sender, receiver = create_shared_memory_pair(
+            capacity=None, max_bytes=1_000_000, oversize="alone"
+        )
+        sender.put(1)
+        with self.assertRaises(mp.queues.Full):
+            sender.put(np.zeros(2_000_000, dtype=np.uint8), timeout=0.1)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        sender.put(np.zeros(2_000_000, dtype=np.uint8), timeout=2)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(2)
+        self.assertEqual(len(receiver.get(timeout=2)), 2_000_000)
+
+    def test_budget_block_size(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=None, max_bytes=10_000, pool_max_bytes=1_000_000
+        )
+        sender.put(np.zeros(5_000, dtype=np.uint8))
+        # charged by its size class, two of them don't fit
+        self.assertEqual(sender.budget.used.value, 8192)
+        with self.assertRaises(mp.queues.Full):
+            sender.put_nowait(np.zeros(5_000, dtype=np.uint8))
+        receiver.get(timeout=2)
+        sender.wait_for_all_ack()
+        self.assertEqual(sender.budget.used.value, 0)
+
+    def test_enqueue_error(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, max_bytes=1_000_000)
+        send = sender._send
+
+        def _send(info, block, timeout):
+            raise ValueError("descriptor can't be sent")
+
+        sender._send = _send
+        with self.assertRaises(ValueError):
+            sender.put(np.zeros(1000))
+        # the segment, capacity and budget were given back
+        self.assertEqual(len(sender.open_handles), 0)
+        self.assertEqual(sender.budget.used.value, 0)
+        sender._send = send
+        sender.put(1, timeout=0.5)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        sender.wait_for_all_ack()
+
+    def test_budget_multi_producer(self):
+        senders, receiver = create_multi_producer_pair(
+            2, capacity=None, max_bytes=3_000_000
+        )
+        senders[0].put(np.zeros(2_000_000, dtype=np.uint8))
+        with self.assertRaises(mp.queues.Full):
+            senders[1].put_nowait(np.zeros(2_000_000, dtype=np.uint8))
+        receiver.get(timeout=2)
+        senders[1].put(np.zeros(2_000_000, dtype=np.uint8), timeout=2)
+
+    # TESTING ACKS
+
+    def test_ack_thread_stops(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        sender.put(1)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        thread = sender.thread_ack
+        sender._cleanup()
+        self.assertFalse(thread.is_alive())
+
+    def test_ack_batch(self):
+        sender, receiver = create_shared_memory_pair(capacity=4, ack_batch=3)
+        for i in range(4):
+            sender.put(i)
+        self.assertEqual([receiver.get(timeout=2) for _ in range(2)], [0, 1])
+        time.sleep(0.1)
+        self.assertEqual(len(sender.open_handles), 4)
+        self.assertEqual(receiver.get(timeout=2), 2)
+        sender.put(4, timeout=2)
+        # the ack thread may still be closing the other handles of the list
+        time.sleep(0.1)
+        self.assertEqual(len(sender.open_handles), 2)
+
+    def test_ack_batch_flush_before_wait(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, ack_batch=8)
+        process = mp.Process(target=_send_many, args=(sender, list(range(20))))
+        process.start()
+        items = [receiver.get(timeout=5) for _ in range(20)]
+        # the producer waits for the acks of the last items
+        receiver.flush_acks()
+        process.join()
+        self.assertEqual(items, list(range(20)))
+        self.assertEqual(process.exitcode, 0)
+
+    def test_ack_batch_flush_at_exit(self):
+        for options in ({"ack_batch": 8}, {"ack_batch": 8, "ack_interval": 10}):
+            sender, receiver = create_shared_memory_pair(capacity=20, **options)
+            process = mp.Process(target=_receive_many, args=(receiver, 20))
+            process.start()
+            for i in range(20):
+                sender.put(i)
+            process.join(timeout=10)
+            self.assertEqual(process.exitcode, 0)
+            waiter = th.Thread(target=sender.wait_for_all_ack, daemon=True)
+            waiter.start()
+            waiter.join(timeout=5)
+            self.assertFalse(waiter.is_alive())
+
+    def test_ack_batch_flush_on_close(self):
+        sender, receiver = create_shared_memory_pair(capacity=4, ack_batch=8)
+        for i in range(3):
+            sender.put(i)
+        # all queued, get doesn't find the queue empty and flush
+        time.sleep(0.1)
+        self.assertEqual([receiver.get(timeout=2) for _ in range(3)], [0, 1, 2])
+        self.assertEqual(receiver.stats()["pending_acks"], 3)
+        receiver.close()
+        self.assertEqual(receiver.stats()["pending_acks"], 0)
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_ack_batch_channel(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=64, channel_slots=64, ack_batch=32
+        )
+        # a list of 32 acks fits into one slot of the ack channel
+        self.assertGreaterEqual(sender.q_ack_in.slot_size, 32 * 64)
+        for i in range(64):
+            sender.put(i)
+        self.assertEqual([receiver.get(timeout=2) for _ in range(64)], list(range(64)))
+        receiver.flush_acks()
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.open_handles), 0)
+
+    def test_ack_interval(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, ack_batch=100, ack_interval=0.05
+        )
+        sender.put(0)
+        sender.put(1)
+        self.assertEqual(receiver.get(timeout=2), 0)
+        # the receiver doesn't call get again, the timer sends the ack
+        sender.put(2, timeout=2)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        self.assertEqual(receiver.get(timeout=2), 2)
+
+    # TESTING METRICS
+
+    def test_metrics(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, inline_threshold=1024, metrics=True
+        )
+        for i in range(5):
+            sender.put(np.zeros(10_000))
+            receiver.get(timeout=2)
+            sender.put(i)
+            receiver.get(timeout=2)
+        sender.wait_for_all_ack()
+
+        stats = sender.stats()
+        self.assertEqual(stats["counters"]["messages"], 10)
+        self.assertEqual(stats["counters"]["inline_messages"], 5)
+        self.assertEqual(stats["outstanding_segments"], 0)
+        for stage in ("serialize", "wait", "allocate", "copy", "enqueue", "ack"):
+            self.assertGreater(stats["stages"][stage]["count"], 0, stage)
+        self.assertEqual(stats["stages"]["ack"]["count"], 5)
+        ack = stats["stages"]["ack"]
+        self.assertLessEqual(ack["p50_s"], ack["max_s"])
+        self.assertEqual(sum(ack["buckets"].values()), 5)
+
+        stats = receiver.stats()
+        self.assertEqual(stats["counters"]["messages"], 10)
+        self.assertEqual(
+            stats["counters"]["bytes"], sender.stats()["counters"]["bytes"]
+        )
+        for stage in ("dequeue", "attach", "copy", "deserialize"):
+            self.assertGreater(stats["stages"][stage]["count"], 0, stage)
+
+    def test_metrics_disabled(self):
+        sender, receiver = create_shared_memory_pair(capacity=2)
+        sender.put(np.zeros(10_000))
+        stats = sender.stats()
+        self.assertNotIn("stages", stats)
+        self.assertEqual(stats["outstanding_segments"], 1)
+        self.assertGreaterEqual(stats["outstanding_bytes"], 80_000)
+        receiver.get(timeout=2)
+        self.assertEqual(receiver.stats()["pending_acks"], 0)
+
+    def test_trace(self):
+        import json
+        import tempfile
+        from memory.trace import write_trace, merge_traces
+
+        sender, receiver = create_shared_memory_pair(capacity=2, trace=True)
+        for _ in range(3):
+            sender.put(np.zeros(10_000))
+            receiver.get(timeout=2)
+        sender.wait_for_all_ack()
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [f"{directory}/sender.json", f"{directory}/receiver.json"]
+            write_trace(paths[0], sender)
+            write_trace(paths[1], receiver, labels=["consumer"])
+            merge_traces(paths, f"{directory}/trace.json")
+            with open(f"{directory}/trace.json") as f:
+                events = json.load(f)["traceEvents"]
+
+        spans = [event for event in events if event["ph"] == "X"]
+        message_ids = {event["args"]["message_id"] for event in spans}
+        self.assertEqual(len(message_ids), 3)
+        for message_id in message_ids:
+            stages = {e["name"] for e in spans if e["args"]["message_id"] == message_id}
+            self.assertTrue({"put", "serialize", "copy", "ack", "get"} <= stages)
+            flows = [e["ph"] for e in events if e.get("id") == message_id]
+            self.assertEqual(sorted(flows), ["f", "s"])
+        self.assertEqual([e["ts"] for e in events], sorted(e["ts"] for e in events))
+
+    # TESTING SEGMENT RECLAMATION
+
+    def test_segment_names(self):
+        from memory.reclaim import segment_owner
+
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        sender.put(np.zeros(1000))
+        ((name, _),) = sender.open_handles.keys()
+        self.assertTrue(name.startswith(f"smq_{os.getpid()}_"))
+        self.assertEqual(segment_owner(name), os.getpid())
+        self.assertIsNone(segment_owner("psm_1234"))
+        receiver.get(timeout=2)
+
+    def test_reclaim_orphaned_segments(self):
+        from multiprocessing import resource_tracker
+        from multiprocessing.shared_memory import SharedMemory
+        from memory import reclaim_orphaned_segments, SegmentSweeper
+        from memory.reclaim import create_segment
+
+        process = mp.Process(target=time.sleep, args=(0,))
+        process.start()
+        process.join()
+
+        def _orphan(name):
+            shm = SharedMemory(f"smq_{process.pid}_{name}", create=True, size=16)
+            # owned by the dead process, not by this one
+            resource_tracker.unregister(shm._name, "shared_memory")
+            shm.close()
+            return shm.name
+
+        orphan = _orphan("a")
+        alive = create_segment(16)
+        try:
+            reclaimed = reclaim_orphaned_segments()
+            self.assertIn(orphan, reclaimed)
+            self.assertNotIn(alive.name, reclaimed)
+
+            orphan = _orphan("b")
+            with SegmentSweeper(interval=0.05) as sweeper:
+                time.sleep(0.2)
+            self.assertGreaterEqual(sweeper.reclaimed, 1)
+            self.assertFalse(os.path.exists(f"/dev/shm/{orphan}"))
+        finally:
+            alive.close()
+            alive.unlink()
+
+    def test_receiver_crash_releases_capacity(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, liveness_interval=0.1, metrics=True
+        )
+        sender.put(np.zeros(1000))
+        process = mp.Process(target=_take_and_die, args=(receiver,))
+        process.start()
+        process.join()
+        # capacity of the lost ack comes back without the receiver
+        sender.put(1, timeout=3)
+        time.sleep(0.3)
+        # still queued, not reclaimed, the next receiver process gets it
+        self.assertEqual(receiver.get(timeout=2), 1)
+        sender.wait_for_all_ack()
+        self.assertEqual(sender.stats()["counters"]["reclaimed"], 1)
+
+    def test_receiver_handoff(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, pool_max_bytes=1_000_000, liveness_interval=0.1
+        )
+        sender.put(b"first!" * 1000)
+        process = mp.Process(target=_receive, args=(receiver, b"first!" * 1000))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        sender.put(b"second" * 1000)
+        # the receiver process is gone, its successor hasn't called get yet
+        time.sleep(0.3)
+        sender.put(b"third!" * 1000)
+        self.assertEqual(receiver.get(timeout=2), b"second" * 1000)
+        self.assertEqual(receiver.get(timeout=2), b"third!" * 1000)
+
+    def test_broadcast_subscriber_crash(self):
+        sender, receivers = create_broadcast_group(2, capacity=1, liveness_interval=0.1)
+        sender.put(0)
+        process = mp.Process(target=_take_and_die, args=(receivers[0],))
+        process.start()
+        process.join()
+        self.assertEqual(receivers[1].get(timeout=2), 0)
+        sender.put(1, timeout=3)
+        self.assertEqual(receivers[1].get(timeout=2), 1)
+        self.assertEqual(sender.stats()["detached"], [0])
+
+    # TESTING STREAMING
+
+    def test_stream_large_payload(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, pool_max_bytes=1_000_000, chunk_size=64 * 1024, stream_window=2
+        )
+        data = {"array": np.arange(100_000), "tail": b"x" * 100_000}
+        process = mp.Process(target=_send_many, args=(sender, [data, 42]))
+        process.start()
+        item = receiver.get(timeout=5)
+        self.assertTrue(np.array_equal(item["array"], data["array"]))
+        self.assertEqual(item["tail"], data["tail"])
+        self.assertEqual(receiver.get(timeout=5), 42)
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    def test_stream_window(self):
+        import threading
+
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, chunk_size=1024, stream_window=2
+        )
+        thread = threading.Thread(target=sender.put, args=(bytes(10_000),))
+        thread.start()
+        time.sleep(0.2)
+        # the window is full after two chunks, the rest waits for the receiver
+        self.assertEqual(len(sender.open_handles), 2)
+        self.assertEqual(receiver.get(timeout=2), bytes(10_000))
+        thread.join(timeout=2)
+        sender.wait_for_all_ack()
+
+    def test_stream_reassembled_in_place(self):
+        from memory import receiver as receiver_module
+
+        sender, receiver = create_shared_memory_pair(capacity=1, chunk_size=30_000)
+        reassembled = []
+        stream_buffers = receiver_module.stream_buffers
+
+        def _stream_buffers(buffer_lengths):
+            buffers, regions = stream_buffers(buffer_lengths)
+            reassembled.extend(buffers)
+            return buffers, regions
+
+        receiver_module.stream_buffers = _stream_buffers
+        try:
+            data = bytes(range(256)) * 400
+            sender.put(data)
+            item = receiver.get(timeout=2)
+        finally:
+            receiver_module.stream_buffers = stream_buffers
+        self.assertEqual(item, data)
+        # the chunks were copied into the bytes object returned, only once
+        self.assertIs(item, reassembled[1])
+
+    def test_put_stream(self):
+        sender, receiver = create_shared_memory_pair(capacity=1, chunk_size=1000)
+        buffers = [b"a" * 1500, bytearray(b"b" * 700), memoryview(b"c" * 10)]
+        sender.put_stream(buffers)
+        chunks = [bytes(chunk) for chunk in receiver.get_stream(timeout=2)]
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 210])
+        self.assertEqual(b"".join(chunks), b"".join(buffers))
+
+        sender.put(1)
+        with self.assertRaises(ValueError):
+            receiver.get_stream(timeout=2)
+        self.assertEqual(receiver.get(timeout=2), 1)
+        sender.put_stream([b"abc", b"def"])
+        self.assertEqual(receiver.get(timeout=2), b"abcdef")
+        sender.wait_for_all_ack()
+
+    # TESTING ATTACH CACHE
+
+    def test_attach_cache_reuses_mappings(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, pool_max_bytes=1_000_000, attach_cache_bytes=1_000_000
+        )
+        for i in range(5):
+            sender.put(np.full(1000, i))
+            self.assertEqual(receiver.get(timeout=2)[0], i)
+            sender.wait_for_all_ack()
+        stats = receiver.stats()
+        self.assertEqual(stats["attach_misses"], 1)
+        self.assertEqual(stats["attach_hits"], 4)
+        self.assertEqual(stats["mapped_segments"], 1)
+
+    def test_attach_cache_invalidation(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=1, attach_cache_bytes=1_000_000
+        )
+        names = []
+        for i in range(3):
+            sender.put(np.full(1000, i))
+            ((name, _),) = sender.open_handles.keys()
+            names.append(name)
+            self.assertEqual(receiver.get(timeout=2)[0], i)
+            sender.wait_for_all_ack()
+        # each segment is unlinked after its ack and reported with the next one
+        self.assertEqual(list(receiver.attach_cache.segments), names[-1:])
+
+    def test_attach_cache_unlinked_names(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=40, channel_slots=64, attach_cache_bytes=100_000_000
+        )
+        for i in range(40):
+            sender.put(np.full(1000, i))
+        for i in range(40):
+            receiver.get(timeout=2)
+        receiver.flush_acks()
+        sender.wait_for_all_ack()
+        self.assertEqual(len(sender.allocator.unlinked), 40)
+
+        # names of a message which couldn't be sent go with the next one
+        send = sender._send
+
+        def _send(info, block, timeout):
+            raise ValueError("descriptor can't be sent")
+
+        sender._send = _send
+        with self.assertRaises(ValueError):
+            sender.put(1)
+        sender._send = send
+        # along with the segment of the message itself
+        self.assertEqual(len(sender.allocator.unlinked), 41)
+
+        sender.put(1)
+        info = receiver._get_info(True, 2)
+        self.assertEqual(len(info.unlinked), 8)
+        self.assertEqual(len(sender.allocator.unlinked), 33)
+        receiver._process_info(info)
+        for _ in range(5):
+            sender.wait_for_all_ack()
+            sender.put(1)
+            receiver.get(timeout=2)
+        # every unlinked segment was reported, only the last one is still mapped
+        self.assertEqual(len(receiver.attach_cache.segments), 1)
+
+    def test_attach_cache_eviction(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=2, arena_size=1_000_000, attach_cache_bytes=1
+        )
+        sender.put(np.zeros(1000))
+        receiver.get(timeout=2)
+        stats = receiver.stats()
+        # a segment larger than the limit stays mapped while it is the only one
+        self.assertEqual(stats["mapped_segments"], 1)
+        self.assertGreaterEqual(stats["mapped_bytes"], 1_000_000)
+
+    # TESTING PREFETCH
+
+    def test_prefetch(self):
+        sender, receiver = create_shared_memory_pair(capacity=8, prefetch=3)
+        for i in range(8):
+            sender.put(np.full(1000, i))
+        self.assertEqual(receiver.get(timeout=2)[0], 0)
+        time.sleep(0.2)
+        self.assertEqual(receiver.stats()["prefetched_items"], 3)
+        # prefetched messages are acked already
+        self.assertEqual(len(sender.open_handles), 4)
+
+        receiver.stop_prefetch()
+        items = [receiver.get(timeout=2)[0] for _ in range(7)]
+        self.assertEqual(items, list(range(1, 8)))
+        with self.assertRaises(mp.queues.Empty):
+            receiver.get(timeout=0.1)
+
+    def test_prefetch_bytes(self):
+        sender, receiver = create_shared_memory_pair(
+            capacity=8, prefetch=8, prefetch_bytes=100_000
+        )
+        for i in range(5):
+            sender.put(bytes(80_000))
+        receiver.get(timeout=2)
+        time.sleep(0.2)
+        # the second message exceeds the limit, no third one is taken
+        self.assertEqual(receiver.stats()["prefetched_items"], 2)
+        self.assertLess(receiver.stats()["prefetched_bytes"], 200_000)
+        for _ in range(4):
+            self.assertEqual(len(receiver.get(timeout=2)), 80_000)
+        receiver.stop_prefetch()
+
+    # TESTING PUT ASYNC
+
+    def test_put_async_order(self):
+        import threading
+
+        sender, receiver = create_shared_memory_pair(
+            capacity=4, put_workers=3, put_depth=4
+        )
+        items = []
+        thread = threading.Thread(
+            target=lambda: items.extend(receiver.get(timeout=5)[0] for _ in range(20))
+        )
+        thread.start()
+        futures = [
+            sender.put_async(np.full(1000, i), immutable=True) for i in range(20)
+        ]
+        for future in futures:
+            self.assertIsNone(future.result(timeout=5))
+        thread.join()
+        self.assertEqual(items, list(range(20)))
+
+    def test_put_async_copies_mutable_data(self):
+        sender, receiver = create_shared_memory_pair(capacity=2)
+        data = np.zeros(100_000)
+        future = sender.put_async(data)
+        # the producer reuses its buffer right away
+        data[:] = 1
+        future.result(timeout=2)
+        self.assertEqual(receiver.get(timeout=2).sum(), 0)
+
+    def test_put_async_errors(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        sender.put(0)
+        future = sender.put_async(1, timeout=0.1)
+        self.assertIsInstance(future.exception(timeout=2), mp.queues.Full)
+        future = sender.put_many_async([2, 3])
+        self.assertIsInstance(future.exception(timeout=2), ValueError)
+        self.assertEqual(receiver.get(timeout=2), 0)
+        sender.put_async(4).result(timeout=2)
+        self.assertEqual(receiver.get(timeout=2), 4)
+
+    # TESTING PARALLEL COPY
+
+    def test_parallel_copy(self):
+        from memory import configure_parallel_copy
+        from memory import memcopy
+
+        threads, min_bytes = memcopy._threads, memcopy._min_bytes
+        configure_parallel_copy(threads=3, min_bytes=1024)
+        try:
+            sender, receiver = create_shared_memory_pair(capacity=2, chunk_size=300_000)
+            data = {"array": np.random.rand(100_001), "bytes": bytes(range(256)) * 999}
+            sender.put(data)
+            item = receiver.get(timeout=2)
+            self.assertTrue(np.array_equal(item["array"], data["array"]))
+            self.assertEqual(item["bytes"], data["bytes"])
+
+            # single segment messages, buffers are copied into bytes objects
+            sender, receiver = create_shared_memory_pair(capacity=2)
+            sender.put(data)
+            item = receiver.get(timeout=2)
+            self.assertTrue(np.array_equal(item["array"], data["array"]))
+            self.assertIs(type(item["bytes"]), bytes)
+            self.assertEqual(item["bytes"], data["bytes"])
+        finally:
+            configure_parallel_copy(threads, min_bytes)
+
+    def test_parallel_copy_fallback(self):
+        from memory import configure_parallel_copy
+        from memory import memcopy
+
+        self.assertIsNotNone(memcopy._new_bytes)
+        # interpreters where bytes can't be filled in place
+        threads, min_bytes = memcopy._threads, memcopy._min_bytes
+        new_bytes, memcopy._new_bytes = memcopy._new_bytes, None
+        configure_parallel_copy(threads=3, min_bytes=1024)
+        try:
+            src = bytes(range(256)) * 999
+            dst = memcopy.copy_out(memoryview(src))
+            self.assertIs(type(dst), bytearray)
+            self.assertEqual(dst, src)
+
+            sender, receiver = create_shared_memory_pair(capacity=2)
+            data = {"array": np.random.rand(100_001), "bytes": src}
+            sender.put(data)
+            item = receiver.get(timeout=2)
+            self.assertTrue(np.array_equal(item["array"], data["array"]))
+            self.assertIs(type(item["bytes"]), bytes)
+            self.assertEqual(item["bytes"], src)
+        finally:
+            memcopy._new_bytes = new_bytes
+            configure_parallel_copy(threads, min_bytes)
+
+    # TESTING SEGMENT BACKING
+
+    def test_segment_backing(self):
+        data = np.random.rand(500_000)
+        for options in ({}, {"pool_max_bytes": 8_000_000}, {"arena_size": 8_000_000}):
+            sender, receiver = create_shared_memory_pair(
+                capacity=2, huge_pages=True, prefault=True, **options
+            )
+            for _ in range(2):
+                sender.put(data)
+                item = receiver.get(timeout=2)
+                self.assertTrue(np.array_equal(item, data), f"Failed with {options}")
+
+    def test_segment_backing_fallback(self):
+        from memory import pages
+        from memory.reclaim import create_segment
+
+        # kernels without either advice, pages are allocated with fallocate
+        advice = pages.MADV_POPULATE_WRITE, pages.MADV_HUGEPAGE
+        pages.MADV_POPULATE_WRITE = pages.MADV_HUGEPAGE = None
+        try:
+            backing = pages.SegmentBacking(huge_pages=True, prefault=True)
+            shm = create_segment(4 * 1024 * 1024, backing)
+        finally:
+            pages.MADV_POPULATE_WRITE, pages.MADV_HUGEPAGE = advice
+        try:
+            shm.buf[:3] = b"abc"
+            self.assertEqual(bytes(shm.buf[:3]), b"abc")
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+    def test_segment_backing_prefault_range(self):
+        from memory.pages import SegmentBacking
+        from memory.reclaim import create_segment
+
+        backing = SegmentBacking(prefault=True)
+        # a pool segment of the 8MB size class created for a 3MB message
+        shm = create_segment(8 * 1024 * 1024, backing, 3 * 1024 * 1024)
+        try:
+            committed = os.stat(f"/dev/shm/{shm.name}").st_blocks * 512
+            self.assertGreaterEqual(committed, 3 * 1024 * 1024)
+            self.assertLess(committed, 4 * 1024 * 1024)
+        finally:
+            shm.close()
+            shm.unlink()
+
     # TESTING DIFFERENT DATA TYPES
 
     def test_None(self):
@@ -201,6 +1568,13 @@ class TestSharedMemory(unittest.TestCase):
         item = receiver.get(timeout=2)
         self.assertEqual(item, data, f"Expected {data}, got {item}")
 
+    def test_bytes_big(self):
+        sender, receiver = create_shared_memory_pair(capacity=1)
+        data = {"a": b"x" * 1_000_000, "b": bytearray(b"y" * 1_000_000)}
+        sender.put(data)
+        item = receiver.get(timeout=2)
+        self.assertEqual(item, data)
+
     def test_str(self):
         sender, receiver = create_shared_memory_pair(capacity=1)
         data = "Hello World!"